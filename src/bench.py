@@ -0,0 +1,412 @@
+import os
+import json
+import time
+import base64
+import random
+import argparse
+import platform
+import threading
+import subprocess
+from contextlib import redirect_stdout
+
+import numpy as np
+import psutil
+import redis
+
+from utils.validators import ValidateModelPath
+from utils.logger import logger, init_logger, logging
+from utils.timestamp import format_event_timestamp
+from utils.handlers.handler_temp import TEMP_DIR, cleanup_temp_dir
+from utils.handlers.handler_redis import RedisPacketHandler
+from utils.handlers.packet_handler import PacketContext
+from utils.eve2pcap import PcapConverter
+from utils.eve2pcap.packet_builder import build_packet
+from utils.flowmeter import FlowFeatureExtractor
+
+try:
+    import fakeredis
+    has_fakeredis = True
+except ImportError:
+    has_fakeredis = False
+
+STAGES = ("ingest", "e2p", "p2c", "mdl", "ffe", "mdl-native", "pipeline", "pipeline-native")
+# Stages running the model, loaded before their peak RSS is sampled.
+MODEL_STAGES = ("mdl", "mdl-native", "pipeline", "pipeline-native")
+
+# Features of models/v2, computed natively when no model is given.
+DEFAULT_FEATURES = [
+    "duration", "payload_bytes_std", "bwd_payload_bytes_variance", "min_header_bytes", "mean_header_bytes",
+    "psh_flag_counts", "rst_flag_counts", "bwd_fin_flag_counts", "bwd_psh_flag_counts", "packet_IAT_max",
+]
+
+TCP_SYN, TCP_SYN_ACK, TCP_PSH_ACK, TCP_FIN_ACK = 0x02, 0x12, 0x18, 0x11
+ETHERTYPES = {4: b"\x08\x00", 6: b"\x86\xdd"}
+
+
+class BenchmarkSkipped(Exception):
+    pass
+
+
+def observers():
+    """
+    Imports the observers, which need NTLFlowLyzer, in the stages using them.
+    """
+    try:
+        import utils.observer
+    except ImportError as e:
+        raise BenchmarkSkipped(f"the observers are not available: {e}")
+    return utils.observer
+
+
+def generate_events(flows: int = 1000, packets_per_flow: int = 10, min_size: int = 0, max_size: int = 1400,
+                    protocols: tuple = ("tcp", "udp"), attack_ratio: float = 0.1, duration: float = 60.0,
+                    seed: int = 0, start: float = 1740413921.0) -> list:
+    """
+    Generates Suricata eve `packet` events of synthetic flows, sorted by timestamp.
+
+    Benign flows exchange `packets_per_flow` packets in both directions, with TCP
+    handshakes and teardowns. A share `attack_ratio` of the flows are port scan probes:
+    a single empty SYN to a random port.
+    """
+    rng = random.Random(seed)
+    timed_events = []
+
+    def add(timestamp, flow_id, src, dst, sport, dport, proto, flags, size):
+        event = {"src_ip": src, "dest_ip": dst, "src_port": sport, "dest_port": dport, "proto": proto}
+        packet = build_packet(event, rng.randbytes(size), flags)
+        version = 6 if ":" in src else 4
+        event.update({
+            "timestamp": format_event_timestamp(timestamp),
+            "flow_id": flow_id,
+            "event_type": "packet",
+            "packet": base64.b64encode(b"\x00" * 12 + ETHERTYPES[version] + packet).decode(),
+            "packet_info": {"linktype": 1},
+        })
+        timed_events.append((timestamp, event))
+
+    for flow_id in range(flows):
+        client = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        server = f"192.168.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        sport = rng.randrange(1024, 65536)
+        timestamp = start + rng.uniform(0, duration)
+
+        if rng.random() < attack_ratio:
+            add(timestamp, flow_id, client, server, sport, rng.randrange(1, 1024), "TCP", TCP_SYN, 0)
+            continue
+
+        proto = rng.choice(protocols).upper()
+        dport = rng.choice((53, 123)) if proto == "UDP" else rng.choice((22, 80, 443))
+        for index in range(packets_per_flow):
+            forward = index % 2 == 0
+            src, dst = (client, server) if forward else (server, client)
+            ports = (sport, dport) if forward else (dport, sport)
+
+            if proto != "TCP":
+                flags, size = 0, rng.randint(min_size, max_size)
+            elif index == 0:
+                flags, size = TCP_SYN, 0
+            elif index == 1:
+                flags, size = TCP_SYN_ACK, 0
+            elif index == packets_per_flow - 1:
+                flags, size = TCP_FIN_ACK, 0
+            else:
+                flags, size = TCP_PSH_ACK, rng.randint(min_size, max_size)
+
+            add(timestamp, flow_id, src, dst, *ports, proto, flags, size)
+            timestamp += rng.expovariate(100)
+
+    timed_events.sort(key=lambda item: item[0])
+    return [event for _, event in timed_events]
+
+
+class RssSampler:
+    """
+    Samples the RSS of the process from a background thread while a stage runs,
+    so each stage reports its own peak instead of the peak of the process so far.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._loop, name="barad-bench-rss", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    @property
+    def peak_mb(self) -> float:
+        return self.peak / 1024 ** 2
+
+
+def summarize(latencies: list, events: int) -> dict:
+    seconds = sum(latencies)
+    return {
+        "events": events,
+        "windows": len(latencies),
+        "seconds": seconds,
+        "events_per_second": events / seconds if seconds else None,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+    }
+
+
+class Benchmark:
+    """
+    Runs the pipeline stages on windows of synthetic events and measures each window.
+    """
+
+    def __init__(self, windows: list, model_path: str = None, backend: str = "auto", redis_url: str = None):
+        self.windows = windows
+        self.events = sum(len(window) for window in windows)
+        self.model_path = model_path
+        self.backend = backend
+        self.redis_url = redis_url
+        self.redis_key = "barad-bench"
+        self._model_node = None
+        self._pcap_files = None
+        self._csv_files = None
+        self._features = None
+
+    def _redis_client(self):
+        if self.redis_url is not None:
+            client = redis.StrictRedis.from_url(self.redis_url)
+            client.ping()
+            return client
+        if has_fakeredis:
+            return fakeredis.FakeStrictRedis()
+        raise BenchmarkSkipped("no --redis-url given and fakeredis is not installed")
+
+    def _redis_handler(self):
+        handler = RedisPacketHandler(redis_key=self.redis_key)
+        handler.redis_client = self._redis_client()
+        handler.redis_client.delete(self.redis_key)
+        return handler
+
+    def _raw_windows(self):
+        return [[json.dumps(event).encode() for event in window] for window in self.windows]
+
+    def model_node(self):
+        if self.model_path is None:
+            raise BenchmarkSkipped("no --model-path given")
+        if self._model_node is None:
+            self._model_node = observers().ModelHandlerObserver(self.model_path, self.backend)
+        return self._model_node
+
+    def selected_features(self) -> list:
+        if self.model_path is None:
+            return DEFAULT_FEATURES
+        # Read from the model directory, without loading the model.
+        with open(os.path.join(self.model_path, "features.json"), "r") as f:
+            return json.load(f)
+
+    def _measure(self, run, inputs, prepare=None) -> dict:
+        latencies = []
+        for item in inputs:
+            if prepare is not None:
+                prepare(item)
+            start_time = time.perf_counter()
+            run(item)
+            latencies.append(time.perf_counter() - start_time)
+        return summarize(latencies, self.events)
+
+    def bench_ingest(self):
+        handler = self._redis_handler()
+        fetch = handler._RedisPacketHandler__fetch_packets
+        push = lambda raws: handler.redis_client.rpush(self.redis_key, *raws)
+        return self._measure(lambda raws: fetch(), self._raw_windows(), prepare=push)
+
+    def bench_e2p(self):
+        self._pcap_files = [f"{TEMP_DIR}bench-{index}.pcap" for index in range(len(self.windows))]
+        converters = [PcapConverter(path) for path in self._pcap_files]
+        return self._measure(lambda item: item[0].run(item[1]), list(zip(converters, self.windows)))
+
+    def bench_p2c(self):
+        if self._pcap_files is None:
+            self.bench_e2p()
+        self._csv_files = [path[:-len(".pcap")] + ".csv" for path in self._pcap_files]
+        converters = [
+            observers().CsvConverterObserver({"pcap_file_address": pcap_file, "output_file_address": csv_file})
+            for pcap_file, csv_file in zip(self._pcap_files, self._csv_files)
+        ]
+        return self._measure(lambda converter: converter.update(), converters)
+
+    def bench_mdl(self):
+        model_handler = self.model_node().model_handler
+        if self._csv_files is None:
+            self.bench_p2c()
+        return self._measure(model_handler.run, self._csv_files)
+
+    def bench_ffe(self):
+        extractor = FlowFeatureExtractor(self.selected_features())
+        self._features = []
+        return self._measure(lambda window: self._features.append(extractor.run(window)[0]), self.windows)
+
+    def bench_mdl_native(self):
+        model_handler = self.model_node().model_handler
+        if self._features is None:
+            self.bench_ffe()
+        return self._measure(model_handler.run_features, self._features)
+
+    def _bench_handler(self, observers):
+        handler = self._redis_handler()
+        for observer in observers:
+            handler.register_observer(observer)
+        # The handler logs the errors of the observers, notify them directly so that they fail the benchmark.
+        fetch = handler._RedisPacketHandler__fetch_packets
+        process = lambda raws: handler.notify_observer(PacketContext(fetch()))
+        push = lambda raws: handler.redis_client.rpush(self.redis_key, *raws)
+        return self._measure(process, self._raw_windows(), prepare=push)
+
+    def bench_pipeline(self):
+        model_node = self.model_node()
+        pcap_file = TEMP_DIR + "bench.pcap"
+        observer = observers()
+        return self._bench_handler([
+            observer.PcapConverterObserver(pcap_file),
+            observer.CsvConverterObserver({"pcap_file_address": pcap_file, "output_file_address": TEMP_DIR + "output.csv"}),
+            model_node,
+        ])
+
+    def bench_pipeline_native(self):
+        model_node = self.model_node()
+        return self._bench_handler([observers().FlowFeatureObserver(self.selected_features()), model_node])
+
+    def run(self, stages) -> dict:
+        results = {}
+        for stage in stages:
+            logger.info("Benchmarking %s on %d events", stage, self.events)
+            try:
+                if stage in MODEL_STAGES:
+                    self.model_node()
+                with open(os.devnull, "w") as devnull, redirect_stdout(devnull), RssSampler() as rss:
+                    results[stage] = getattr(self, "bench_" + stage.replace("-", "_"))()
+                results[stage]["peak_rss_mb"] = rss.peak_mb
+            except BenchmarkSkipped as e:
+                results[stage] = {"skipped": str(e)}
+            except Exception as e:
+                logger.error("Benchmark of %s failed: %s", stage, str(e))
+                results[stage] = {"error": str(e)}
+        return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    events = generate_events(args.flows, args.packets_per_flow, args.min_size, args.max_size,
+                             tuple(args.protocols.split(",")), args.attack_ratio, args.duration, args.seed)
+    windows = [events[start:start + args.window_size] for start in range(0, len(events), args.window_size)]
+    stages = STAGES if args.stages == "all" else args.stages.split(",")
+
+    benchmark = Benchmark(windows, args.model_path, args.backend, args.redis_url)
+    try:
+        results = benchmark.run(stages)
+    finally:
+        cleanup_temp_dir()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose", "verbose_debug")},
+        "stages": results,
+    }
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Barad-dur stages on synthetic Suricata traffic.")
+
+    parser.add_argument(
+        "--model-path", "-m",
+        type=str,
+        default=None,
+        help="Path to the model directory. Without it, the stages needing the model are skipped.",
+        action=ValidateModelPath
+    )
+
+    parser.add_argument(
+        "--backend",
+        choices=["auto", "keras", "onnx", "tflite"],
+        default="auto",
+        help="Inference backend. 'auto' prefers model.onnx, then model.tflite, then model.keras."
+    )
+
+    parser.add_argument(
+        "--stages",
+        type=str,
+        default="all",
+        help=f"Comma-separated stages to run among {', '.join(STAGES)}, or 'all'."
+    )
+
+    parser.add_argument(
+        "--redis-url",
+        type=str,
+        default=None,
+        help="Redis to ingest from, e.g. redis://localhost:6379/15. Defaults to an in-process fakeredis."
+    )
+
+    parser.add_argument("--flows", type=int, default=1000, help="Number of synthetic flows.")
+    parser.add_argument("--packets-per-flow", type=int, default=10, help="Packets of each benign flow.")
+    parser.add_argument("--min-size", type=int, default=0, help="Minimum payload size of the data packets.")
+    parser.add_argument("--max-size", type=int, default=1400, help="Maximum payload size of the data packets.")
+    parser.add_argument("--protocols", type=str, default="tcp,udp", help="Comma-separated protocols of the benign flows.")
+    parser.add_argument("--attack-ratio", type=float, default=0.1, help="Share of the flows that are port scan probes.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of recorded traffic the flows start in.")
+    parser.add_argument("--window-size", type=int, default=5000, help="Events per window.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the traffic generator.")
+
+    parser.add_argument(
+        "--output", "-o",
+        type=str,
+        default=None,
+        help="Write the JSON report to this file instead of stdout."
+    )
+
+    parser.add_argument(
+        "--verbose", "-v",
+        action="store_true",
+        help="Enable verbose logging."
+    )
+
+    parser.add_argument(
+        "--verbose-debug", "-vv",
+        action="store_true",
+        help="Enable debug logging."
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose or args.verbose_debug:
+        init_logger(logging.DEBUG if args.verbose_debug else logging.INFO)
+    else:
+        # The alerts of the synthetic attacks are warnings, keep the report readable.
+        logger.setLevel(logging.ERROR)
+
+    main(args)
@@ -0,0 +1,154 @@
+import os
+import argparse
+from utils.validators import ValidateModelPath
+from utils.logger import logger, init_logger, logging
+
+
+def export_onnx(model, model_path: str, quantize: bool, batch_size: int):
+    """
+    Convert the Keras model to `model.onnx`, optionally with int8 dynamic quantization of the weights.
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    output_path = os.path.join(model_path, "model.onnx")
+    input_signature = [tf.TensorSpec((None,) + tuple(model.inputs[0].shape[1:]), tf.float32, name="features")]
+
+    # from_keras does not follow the Keras 3 tensor names, convert the traced call instead.
+    @tf.function(input_signature=input_signature)
+    def infer(features):
+        return model(features, training=False)
+
+    tf2onnx.convert.from_function(infer, input_signature=input_signature, opset=17, output_path=output_path)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(output_path, output_path, weight_type=QuantType.QInt8)
+
+    return output_path
+
+
+def export_tflite(model, model_path: str, quantize: bool, batch_size: int):
+    """
+    Convert the Keras model to `model.tflite`, optionally with int8 dynamic-range quantization.
+    The batch size is fixed, as the recurrent layers cannot be lowered with a dynamic one.
+    """
+    import tensorflow as tf
+
+    input_spec = tf.TensorSpec((batch_size,) + tuple(model.inputs[0].shape[1:]), tf.float32)
+
+    @tf.function(input_signature=[input_spec])
+    def infer(features):
+        return model(features, training=False)
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([infer.get_concrete_function()])
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    output_path = os.path.join(model_path, "model.tflite")
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+    return output_path
+
+
+def fit_preprocessing(model_path: str, data_paths: list):
+    """
+    Fit `preprocessing.json` on the NTLFlowLyzer CSV files the model was trained on,
+    so the scaling and encoding stay the same from one window to the next.
+    """
+    import json
+    import numpy as np
+    import pandas as pd
+    from utils.model.preprocessing import Preprocessor, PREPROCESSING_FILENAME
+
+    with open(os.path.join(model_path, "features.json"), "r") as f:
+        selected_features = json.load(f)
+
+    def needed(column):
+        return column in selected_features or any(feature.startswith(column + "_") for feature in selected_features)
+
+    frames = []
+    for path in data_paths:
+        logger.debug("Reading %s", path)
+        frames.append(pd.read_csv(path, usecols=needed))
+    data = pd.concat(frames, ignore_index=True)
+    data.replace([np.inf, -np.inf], np.nan, inplace=True)
+
+    Preprocessor.fit(data, selected_features).save(model_path)
+    return os.path.join(model_path, PREPROCESSING_FILENAME)
+
+
+EXPORTERS = {
+    "onnx": export_onnx,
+    "tflite": export_tflite,
+}
+
+
+def main(model_path: str, export_format: str, quantize: bool, batch_size: int, data_paths: list = None):
+    if export_format == "preprocessing":
+        output_path = fit_preprocessing(model_path, data_paths)
+        print(f"Pre-processing fitted to {output_path}")
+        return
+
+    import tensorflow as tf
+
+    logger.debug("Loading %s", os.path.join(model_path, "model.keras"))
+    model = tf.keras.models.load_model(os.path.join(model_path, "model.keras"))
+    output_path = EXPORTERS[export_format](model, model_path, quantize, batch_size)
+    print(f"Model exported to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a Barad-dur model to a lightweight inference runtime.")
+
+    parser.add_argument(
+        "--model-path", "-m",
+        type=str,
+        required=True,
+        help="Path to the model directory.",
+        action=ValidateModelPath
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=list(EXPORTERS.keys()) + ["preprocessing"],
+        default="onnx",
+        help="Runtime format to export the model to, or 'preprocessing' to fit preprocessing.json on --data."
+    )
+
+    parser.add_argument(
+        "--data",
+        type=str,
+        nargs="+",
+        metavar="CSV_PATH",
+        help="NTLFlowLyzer CSV files the model was trained on, for --format preprocessing."
+    )
+
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Quantize the weights to int8. Check the detection rate of the quantized model before deploying it."
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Fixed batch size of the TFLite model."
+    )
+
+    parser.add_argument(
+        "--verbose-debug", "-vv",
+        action="store_true",
+        help="Enable debug logging."
+    )
+
+    args = parser.parse_args()
+    if args.format == "preprocessing" and not args.data:
+        parser.error("--format preprocessing requires --data.")
+
+    if args.verbose_debug:
+        init_logger(logging.DEBUG)
+
+    main(args.model_path, args.format, args.quantize, args.batch_size, args.data)
@@ -1,10 +1,21 @@
+import os
 import argparse
 from utils.validators import ValidateModelPath, ValidateFilePath
 from utils.logger import logger, init_logger, logging
 from utils.handlers.handler_redis import RedisPacketHandler
-from utils.handlers.handler_temp import TEMP_DIR, setup_temp_dir, cleanup_temp_dir
-from utils.observer import PcapConverterObserver, CsvConverterObserver, ModelHandlerObserver
+from utils.handlers.handler_stream import RedisStreamPacketHandler
+from utils.handlers.handler_temp import TEMP_DIR, StagingArea, setup_temp_dir, cleanup_temp_dir
+from utils.observer import PcapConverterObserver, CsvConverterObserver, ModelHandlerObserver, FlowFeatureObserver, StagingObserver
 from utils.handlers.handler_file import FilePacketHandler  # Import the new handler
+from utils.handlers.handler_eve import EveFilePacketHandler
+from utils.handlers.packet_handler import PacketContext
+from utils.handlers.load_shedding import AdaptiveScheduler, LoadShedder, SHED_POLICIES
+from utils.flowmeter import FlowTable
+from utils.pipeline import PipelineObserver
+from utils.sharding import ShardedObserver
+from utils.monitoring import metrics
+from utils.alerts import open_sink
+from utils.model.preprocessing import PREPROCESSING_FILENAME
 
 
 def display_banner(model: str, redis_key: str, timeout: int, file_path: str):
@@ -37,37 +48,183 @@ Information:
     print("\n-----------------------------------------------------------\n")
 
 
-def main(redis_key, timeout, model_path, file_path):
+def csv_converter_observer(pcap_file=TEMP_DIR + "output.pcap"):
+    return CsvConverterObserver({
+            "pcap_file_address": pcap_file,
+            "output_file_address": TEMP_DIR + "output.csv"
+        })
+
+
+def flush_flow_tables(observers):
+    """
+    Classifies the flows still tracked by the flow tables before exiting.
+    """
+    context = PacketContext([], {"flush": True})
+    context.retain()
+    try:
+        for observer in observers:
+            observer.update(context)
+    except Exception as e:
+        logger.error("Failed to flush the flow table: %s", str(e))
+        context.release(e)
+        return
+    context.release()
+
+
+def main(args):
+    pipeline = None
+    sharded = None
+    model_node = None
+    staging = None
+    stream_observers = []
+    # Live handlers never send the end-of-input flush the file handlers send.
+    live = False
     try:
         logger.debug("Starting packet processing pipeline...")
 
+        if args.metrics_port is not None:
+            metrics.serve(args.metrics_port)
+
+        def model_observer():
+            alert_sink = open_sink(args.alert_sink) if args.alert_sink is not None else None
+            return ModelHandlerObserver(args.model_path, args.backend, alert_sink,
+                                        args.alert_dedup_ttl, args.alert_summary_threshold,
+                                        args.prediction_cache, args.prediction_cache_ttl)
+
+        # With shards, every worker loads its own model and alert sink after the fork.
+        model_node = model_observer() if not args.shards else None
+
+        if args.native_features:
+            def feature_observer(selected_features):
+                flow_table = None
+                # Files are streamed in chunks, flows must be kept across them.
+                if args.flow_table or args.read_file is not None or args.read_eve is not None:
+                    flow_table = FlowTable(
+                        idle_timeout=args.flow_idle_timeout,
+                        active_timeout=args.flow_active_timeout,
+                        max_flows=args.max_flows
+                    )
+                return FlowFeatureObserver(selected_features, flow_table, args.emit_updates)
+
+            def shard_observers():
+                shard_model = model_observer()
+                return [feature_observer(shard_model.model_handler.selected_features), shard_model]
+
+            if args.shards > 0:
+                # The records are routed undecoded, each shard decodes, builds the flows and runs the model.
+                sharded = ShardedObserver(shard_observers, args.shards)
+                sharded.start()
+                stream_stages = {"SHD": [sharded]}
+            else:
+                stream_stages = {
+                    "FFE": [feature_observer(model_node.model_handler.selected_features)],
+                    "MDL": [model_node]
+                }
+        else:
+            # Each window gets its own pcap and CSV files, so the conversions can overlap.
+            staging = StagingArea()
+            stream_stages = {
+                "E2P": [StagingObserver(staging), PcapConverterObserver()],
+                "P2C": [csv_converter_observer()],
+                "MDL": [model_node]
+            }
+
+        if args.pipeline:
+            pipeline = PipelineObserver(stream_stages, args.queue_size)
+            pipeline.start()
+            stream_observers = [pipeline]
+        else:
+            stream_observers = [observer for observers in stream_stages.values() for observer in observers]
+
+        if args.read_dir is not None:
+            batch_conv = CsvConverterObserver({
+                    "pcap_file_address": None,
+                    "batch_address": args.read_dir,
+                    "batch_address_output": TEMP_DIR,
+                    "continues_batch_address": None
+                },
+                batch_mode=True,
+                workers=args.workers,
+                on_result=model_node.run_file
+            )
+            logger.debug("Batch converter initialized.")
+            batch_conv.update()
+            return
+
+        if args.read_eve is not None:
+            packet_handler = EveFilePacketHandler(
+                path=args.read_eve,
+                chunk_size=args.chunk_size,
+                timeout=args.timeout,
+                speed=args.replay_speed
+            )
+            logger.debug("Eve replay handler initialized.")
+            for observer in stream_observers:
+                packet_handler.register_observer(observer)
 
-        pcap_conv = PcapConverterObserver(output_filename=TEMP_DIR + "output.pcap")
-        csv_conv = CsvConverterObserver({
-                "pcap_file_address": TEMP_DIR + "output.pcap",
-                "output_file_address": TEMP_DIR + "output.csv"
-            })
-        model_node = ModelHandlerObserver(model_path)
+        elif args.read_file is None and args.stream:
+            packet_handler = RedisStreamPacketHandler(
+                redis_key=args.redis_key,
+                group=args.group,
+                consumer=args.consumer,
+                max_replays=args.max_replays,
+                raw_records=args.shards > 0,
+                timeout=args.timeout,
+                chunk_size=args.chunk_size,
+                max_window_size=args.max_window_size
+            )
+            live = True
+            logger.debug("Redis stream handler initialized.")
+            for observer in stream_observers:
+                packet_handler.register_observer(observer)
 
-        if file_path is None:
+        elif args.read_file is None:
+            scheduler = shedder = None
+            if args.adaptive or args.shed_policy:
+                scheduler = AdaptiveScheduler(
+                    target_latency=args.target_latency or args.timeout,
+                    min_window_size=min(args.min_window_size, args.max_window_size),
+                    max_window_size=args.max_window_size
+                )
+            if args.shed_policy:
+                shedder = LoadShedder(args.shed_policy, args.shed_protocols.split(","))
             packet_handler = RedisPacketHandler(
-                redis_key=redis_key,
-                timeout=timeout
+                redis_key=args.redis_key,
+                timeout=args.timeout,
+                chunk_size=args.chunk_size,
+                blocking=args.blocking,
+                max_window_size=args.max_window_size,
+                scheduler=scheduler,
+                shedder=shedder,
+                reliable=args.reliable,
+                consumer=args.consumer,
+                max_replays=args.max_replays,
+                raw_records=args.shards > 0
             )
+            live = True
             logger.debug("Redis handler initialized.")
-            packet_handler.register_observer(pcap_conv)
-            packet_handler.register_observer(csv_conv)
-            packet_handler.register_observer(model_node)
+            for observer in stream_observers:
+                packet_handler.register_observer(observer)
 
 
+        elif args.native_features:
+            packet_handler = FilePacketHandler(
+                file_path=args.read_file,
+                chunk_size=args.chunk_size
+            )
+            logger.debug("File handler initialized.")
+            for observer in stream_observers:
+                packet_handler.register_observer(observer)
+
         else:
+            # NTLFlowLyzer has no flow table to carry flows across chunks: the file is converted whole.
             packet_handler = FilePacketHandler(
-                file_path=file_path 
+                file_path=args.read_file
             )
             logger.debug("File handler initialized.")
-            packet_handler.register_observer(csv_conv)
+            packet_handler.register_observer(csv_converter_observer(args.read_file))
             packet_handler.register_observer(model_node)
-            
+
 
         logger.debug("Observers registered.")
 
@@ -79,6 +236,16 @@ def main(redis_key, timeout, model_path, file_path):
         logger.info("Exiting...")
 
     finally:
+        if live and args.native_features:
+            flush_flow_tables(stream_observers)
+        if pipeline is not None:
+            pipeline.stop()
+        if sharded is not None:
+            sharded.stop()
+        if model_node is not None:
+            model_node.close()
+        if staging is not None:
+            staging.close()
         cleanup_temp_dir()
         pass
 
@@ -94,6 +261,13 @@ if __name__ == "__main__":
         action=ValidateModelPath
     )
 
+    parser.add_argument(
+        "--backend",
+        choices=["auto", "keras", "onnx", "tflite"],
+        default="auto",
+        help="Inference backend. 'auto' prefers model.onnx, then model.tflite, then model.keras."
+    )
+
     parser.add_argument(
         "--read-file", "-f", 
         type=str,
@@ -102,6 +276,36 @@ if __name__ == "__main__":
         action=ValidateFilePath
     )
 
+    parser.add_argument(
+        "--read-dir", "-d",
+        type=str,
+        metavar="DIR_PATH",
+        help="Path to a directory of pcap files to analyze in batch.",
+        action=ValidateFilePath
+    )
+
+    parser.add_argument(
+        "--read-eve", "-e",
+        type=str,
+        metavar="EVE_PATH",
+        help="Path to an eve.json file (optionally gzipped) or a directory of rotated ones to replay.",
+        action=ValidateFilePath
+    )
+
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=0,
+        help="Replay speed of --read-eve relative to the recorded timestamps; 0 replays as fast as possible."
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes converting the files of --read-dir in parallel."
+    )
+
     parser.add_argument(
         "--redis-key", "-k",
         type=str, 
@@ -116,6 +320,205 @@ if __name__ == "__main__":
         help="Timeout for processing packets if reading from stream."
     )
 
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=5000,
+        help="Number of records drained from Redis per round-trip, or of packets per chunk with --read-file and --native-features "
+             "(without --native-features, the file is converted and predicted whole)."
+    )
+
+    parser.add_argument(
+        "--blocking",
+        action="store_true",
+        help="Open a window as soon as packets arrive and close it on --timeout or --max-window-size, whichever comes first."
+    )
+
+    parser.add_argument(
+        "--max-window-size",
+        type=int,
+        default=50000,
+        help="Maximum number of packets in a window when --blocking or --stream is set."
+    )
+
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Size the windows read from a Redis list from the backlog and the processing time, "
+             "up to --max-window-size, and start the next window right away when falling behind."
+    )
+
+    parser.add_argument(
+        "--target-latency",
+        type=float,
+        default=None,
+        help="Seconds the processing of an adaptive window should take. Defaults to --timeout."
+    )
+
+    parser.add_argument(
+        "--min-window-size",
+        type=int,
+        default=1000,
+        help="Minimum number of packets of an adaptive window."
+    )
+
+    parser.add_argument(
+        "--shed-policy",
+        action="append",
+        choices=SHED_POLICIES,
+        default=[],
+        help="Shedding policy applied, in the given order, to the adaptive windows above their budget when "
+             "falling behind: 'protocol' drops --shed-protocols, 'sample' keeps a share of the flows. "
+             "Repeat to combine; implies --adaptive."
+    )
+
+    parser.add_argument(
+        "--shed-protocols",
+        type=str,
+        default="ICMP,IPv6-ICMP",
+        help="Comma-separated low-priority protocols dropped by the 'protocol' shedding policy."
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read packets from a Redis Stream through a consumer group instead of a list."
+    )
+
+    parser.add_argument(
+        "--group",
+        type=str,
+        default="barad-dur",
+        help="Consumer group name when --stream is set."
+    )
+
+    parser.add_argument(
+        "--consumer",
+        type=str,
+        default=None,
+        help="Consumer name when --stream or --reliable is set. Defaults to the hostname, so a restarted "
+             "consumer gets back its pending entries or in-flight windows."
+    )
+
+    parser.add_argument(
+        "--reliable",
+        action="store_true",
+        help="When reading a Redis list, move each window to a processing list removed only once the window "
+             "was processed, and replay the windows left there by a previous run. A failed window is only "
+             "retried by the next run."
+    )
+
+    parser.add_argument(
+        "--max-replays",
+        type=int,
+        default=3,
+        help="With --reliable, replays of a window after which its records are moved to the <redis-key>:dead-letter list; "
+             "with --stream, reclaims of an entry after which it is moved to the <redis-key>:dead-letter stream."
+    )
+
+    parser.add_argument(
+        "--native-features",
+        action="store_true",
+        help="Compute the model features directly from the eve packets, without the pcap and CSV conversions."
+    )
+
+    parser.add_argument(
+        "--flow-table",
+        action="store_true",
+        help="With --native-features, keep flows across windows and analyse them once they complete."
+    )
+
+    parser.add_argument(
+        "--flow-idle-timeout",
+        type=float,
+        default=120,
+        help="Seconds without packets after which a flow of the flow table is complete."
+    )
+
+    parser.add_argument(
+        "--flow-active-timeout",
+        type=float,
+        default=1800,
+        help="Maximum duration in seconds of a flow of the flow table."
+    )
+
+    parser.add_argument(
+        "--max-flows",
+        type=int,
+        default=100000,
+        help="Maximum number of flows kept in the flow table; the least recently updated are emitted first."
+    )
+
+    parser.add_argument(
+        "--emit-updates",
+        action="store_true",
+        help="With --flow-table, also analyse the flows still active that were updated in each window."
+    )
+
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run ingestion, feature extraction and inference concurrently, connected by bounded queues."
+    )
+
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=2,
+        help="Maximum number of windows waiting in front of each stage when --pipeline is set."
+    )
+
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="With --native-features, decode the records, build the flows and run the model in N worker processes; "
+             "the packets of a flow always go to the same worker."
+    )
+
+    parser.add_argument(
+        "--prediction-cache",
+        type=int,
+        default=0,
+        help="Cache the predictions of up to N model inputs, rounded to 4 decimals, so repeated flows skip the model. "
+             "Requires the model's preprocessing.json, as inputs scaled per window never repeat. 0 disables it."
+    )
+
+    parser.add_argument(
+        "--prediction-cache-ttl",
+        type=float,
+        default=300,
+        help="Seconds a cached prediction is reused."
+    )
+
+    parser.add_argument(
+        "--alert-sink",
+        type=str,
+        default=None,
+        help="Write eve-style alert records to list:KEY or stream:KEY on Redis, or to file:PATH as JSON lines."
+    )
+
+    parser.add_argument(
+        "--alert-dedup-ttl",
+        type=float,
+        default=300,
+        help="Seconds during which a flow already reported is not reported again."
+    )
+
+    parser.add_argument(
+        "--alert-summary-threshold",
+        type=int,
+        default=100,
+        help="Above this number of alerts with the same label in a window, a single summary record is written."
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve the metrics in the Prometheus text format on http://127.0.0.1:PORT/metrics."
+    )
+
     parser.add_argument(
         "--verbose", "-v", 
         action="store_true", 
@@ -130,8 +533,18 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.shards and not args.native_features:
+        parser.error("--shards requires --native-features.")
+    if args.shards and args.read_dir is not None:
+        parser.error("--shards does not apply to --read-dir, use --workers.")
+    if args.shards and args.shed_policy:
+        parser.error("--shed-policy cannot be combined with --shards, the records are only decoded by the shards.")
+    if args.prediction_cache and not os.path.exists(os.path.join(args.model_path, PREPROCESSING_FILENAME)):
+        parser.error(f"--prediction-cache requires a fitted {PREPROCESSING_FILENAME} in the model directory "
+                     "(see export.py --format preprocessing).")
+
     if args.verbose or args.verbose_debug:
        init_logger(logging.DEBUG if args.verbose_debug else logging.INFO)
                 
-    display_banner(args.model_path, args.redis_key, args.timeout, args.read_file)
-    main(args.redis_key, args.timeout, args.model_path, args.read_file)
+    display_banner(args.model_path, args.redis_key, args.timeout, args.read_file or args.read_dir or args.read_eve)
+    main(args)
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from utils.handlers import handler_stream
+from utils.handlers.handler_stream import RedisStreamPacketHandler
+
+KEY = "suricata-packets"
+GROUP = "barad-dur"
+
+
+class Recorder:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.windows = []
+
+    def update(self, context):
+        if context.metadata.get("tick"):
+            return
+        self.windows.append(context.packets)
+        if self.fail:
+            raise ValueError("window failed")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(handler_stream.redis, "StrictRedis", lambda *args, **kwargs: client)
+    return client
+
+
+def make_handler(consumer, observer, max_replays=3):
+    handler = RedisStreamPacketHandler(redis_key=KEY, group=GROUP, consumer=consumer, timeout=0.01,
+                                       min_idle_time=0, max_replays=max_replays)
+    handler.register_observer(observer)
+    return handler
+
+
+def process_window(handler):
+    ids, packets = handler._RedisStreamPacketHandler__collect_window()
+    if ids:
+        handler._RedisStreamPacketHandler__process_packets(ids, packets)
+    return ids
+
+
+def add_events(client, count):
+    return [client.xadd(KEY, {"eve": json.dumps({"flow_id": index, "packet": "AAAA"})}) for index in range(count)]
+
+
+def test_reclaims_the_entries_of_a_dead_consumer(client):
+    make_handler("dead", Recorder())
+    ids = add_events(client, 3)
+    # Read by a consumer that died before acknowledging them.
+    client.xreadgroup(GROUP, "dead", {KEY: ">"})
+
+    observer = Recorder()
+    handler = make_handler("alive", observer)
+    assert process_window(handler) == ids
+    assert [event["flow_id"] for event in observer.windows[0]] == [0, 1, 2]
+    assert client.xpending(KEY, GROUP)["pending"] == 0
+
+
+def test_dead_letters_the_entries_failing_every_replay(client):
+    observer = Recorder(fail=True)
+    handler = make_handler("worker", observer, max_replays=2)
+    ids = add_events(client, 2)
+
+    # The first delivery and two replays fail and leave the entries pending.
+    for _ in range(3):
+        assert process_window(handler) == ids
+    assert client.xpending(KEY, GROUP)["pending"] == 2
+
+    assert process_window(handler) == []
+    assert client.xpending(KEY, GROUP)["pending"] == 0
+    dead = client.xrange(f"{KEY}:dead-letter")
+    assert [fields[b"stream_id"] for _, fields in dead] == ids
+    assert len(observer.windows) == 3
+
+
+def test_dead_letters_the_claimed_entries_around_a_recent_one(client):
+    handler = make_handler("worker", Recorder(), max_replays=0)
+    handler.min_idle_time = 1000
+    first, recent, last = add_events(client, 3)
+    client.xreadgroup(GROUP, "worker", {KEY: ">"})
+    # The first and last entries failed a replay long ago, the one between them was just read.
+    client.xclaim(KEY, GROUP, "worker", 0, [first, last], idle=5000)
+
+    assert process_window(handler) == []
+    assert [fields[b"stream_id"] for _, fields in client.xrange(f"{KEY}:dead-letter")] == [first, last]
+    assert [entry["message_id"] for entry in client.xpending_range(KEY, GROUP, "-", "+", 10)] == [recent]
@@ -0,0 +1,245 @@
+import json
+import time
+import redis
+import logging
+import numpy as np
+from collections import Counter, OrderedDict
+
+from utils.monitoring import metrics
+from utils.timestamp import format_event_timestamp
+
+barad_logger = logging.getLogger("barad_logger")
+
+PROTOCOL_NAMES = {1: "ICMP", 6: "TCP", 17: "UDP", 58: "IPv6-ICMP"}
+
+
+class AlertSink:
+    """
+    Destination of the alert records.
+    """
+
+    def write(self, records: list):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RedisListSink(AlertSink):
+    """
+    Pushes the alert records as JSON to a Redis list, in pipelined batches.
+    """
+
+    def __init__(self, key="barad-alerts", host="localhost", port=6379, db=0, batch_size=500):
+        self.redis_client = redis.StrictRedis(host=host, port=port, db=db)
+        self.key = key
+        self.batch_size = batch_size
+
+    def write(self, records: list):
+        lines = [json.dumps(record) for record in records]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for start in range(0, len(lines), self.batch_size):
+            pipe.rpush(self.key, *lines[start:start + self.batch_size])
+        pipe.execute()
+
+
+class RedisStreamSink(AlertSink):
+    """
+    Adds the alert records as JSON to a capped Redis stream, in one pipeline.
+    """
+
+    def __init__(self, key="barad-alerts", host="localhost", port=6379, db=0, field="alert", maxlen=100000):
+        self.redis_client = redis.StrictRedis(host=host, port=port, db=db)
+        self.key = key
+        self.field = field
+        self.maxlen = maxlen
+
+    def write(self, records: list):
+        pipe = self.redis_client.pipeline(transaction=False)
+        for record in records:
+            pipe.xadd(self.key, {self.field: json.dumps(record)}, maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+
+
+class FileSink(AlertSink):
+    """
+    Appends the alert records as JSON lines to a file, in one write per batch.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, records: list):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+SINKS = {
+    "list": RedisListSink,
+    "stream": RedisStreamSink,
+    "file": FileSink,
+}
+
+
+def open_sink(spec: str) -> AlertSink:
+    """
+    Opens an alert sink from a "list:KEY", "stream:KEY" or "file:PATH" specification.
+    """
+    kind, _, target = spec.partition(":")
+    if kind not in SINKS or not target:
+        raise ValueError(f"Invalid alert sink '{spec}', expected list:KEY, stream:KEY or file:PATH.")
+    return SINKS[kind](target)
+
+
+def flow_identity(flow) -> dict:
+    """
+    Returns the identity of a flow of the FlowFeatureExtractor as alert fields.
+    """
+    return {
+        "flow_id": flow.flow_id,
+        "src_ip": flow.src_ip,
+        "src_port": flow.src_port,
+        "dest_ip": flow.dst_ip,
+        "dest_port": flow.dst_port,
+        "proto": PROTOCOL_NAMES.get(flow.protocol, str(flow.protocol)),
+        "start": format_event_timestamp(flow.start_time),
+        "end": format_event_timestamp(flow.last_seen),
+    }
+
+
+def csv_identity(row: dict) -> dict:
+    """
+    Returns the identity of a row of the NTLFlowLyzer CSV as alert fields.
+    """
+    protocol = row.get("protocol")
+    if protocol is not None and str(protocol).isdigit():
+        protocol = PROTOCOL_NAMES.get(int(protocol), str(protocol))
+    return {
+        "flow_id": row.get("flow_id"),
+        "src_ip": row.get("src_ip"),
+        "src_port": row.get("src_port"),
+        "dest_ip": row.get("dst_ip"),
+        "dest_port": row.get("dst_port"),
+        "proto": protocol,
+        "start": row.get("timestamp"),
+        "end": None,
+    }
+
+
+class AlertAggregator:
+    """
+    Turns the malicious predictions of a window into eve-style alert records.
+
+    A flow already reported within `dedup_ttl` seconds is not reported again, and
+    when more than `summary_threshold` flows of a window share a label, they are
+    reported as a single summary record.
+    """
+
+    def __init__(self, sink: AlertSink, model_version: str = None, dedup_ttl: float = 300,
+                 summary_threshold: int = 100, max_tracked: int = 100000):
+        self.sink = sink
+        self.model_version = model_version
+        self.dedup_ttl = dedup_ttl
+        self.summary_threshold = summary_threshold
+        self.max_tracked = max_tracked
+        self.reported = OrderedDict()
+        self.suppressed = metrics.counter("barad_alerts_suppressed", "Alerts of flows already reported.")
+
+    def _is_reported(self, key, now: float) -> bool:
+        reported_at = self.reported.get(key)
+        return reported_at is not None and now - reported_at < self.dedup_ttl
+
+    def _mark_reported(self, keys: set, now: float):
+        for key in keys:
+            self.reported[key] = now
+            self.reported.move_to_end(key)
+        while len(self.reported) > self.max_tracked:
+            self.reported.popitem(last=False)
+
+    def _alert(self, identity: dict, label: str, score: float) -> dict:
+        return {
+            "timestamp": identity["start"] or format_event_timestamp(time.time()),
+            "event_type": "alert",
+            "flow_id": identity["flow_id"],
+            "src_ip": identity["src_ip"],
+            "src_port": identity["src_port"],
+            "dest_ip": identity["dest_ip"],
+            "dest_port": identity["dest_port"],
+            "proto": identity["proto"],
+            "flow": {"start": identity["start"], "end": identity["end"]},
+            "alert": {"signature": f"Barad-dur {label}", "category": label, "score": score, "model": self.model_version},
+        }
+
+    def _summary(self, alerts: list, label: str) -> dict:
+        starts = [alert["flow"]["start"] for alert in alerts if alert["flow"]["start"]]
+        ends = [alert["flow"]["end"] for alert in alerts if alert["flow"]["end"]]
+        sources = Counter(alert["src_ip"] for alert in alerts)
+        destinations = Counter(alert["dest_ip"] for alert in alerts)
+        return {
+            "timestamp": format_event_timestamp(time.time()),
+            "event_type": "alert_summary",
+            "flow": {"start": min(starts, default=None), "end": max(ends, default=None)},
+            "alert": {
+                "signature": f"Barad-dur {label}",
+                "category": label,
+                "score": max(alert["alert"]["score"] for alert in alerts),
+                "model": self.model_version,
+                "count": len(alerts),
+                "src_ips": len(sources),
+                "dest_ips": len(destinations),
+                "top_src_ips": dict(sources.most_common(5)),
+                "top_dest_ips": dict(destinations.most_common(5)),
+            },
+        }
+
+    def build(self, rows: list, labels, scores, identity_of=flow_identity) -> tuple:
+        """
+        Returns the alert and summary records of the malicious rows of a window, and the
+        keys of their flows, to mark as reported once the records are written.
+
+        :param rows: Flows or CSV rows of the window, turned into alert fields by `identity_of`.
+        """
+        now = time.time()
+        groups, keys = {}, set()
+        for index in np.flatnonzero(np.asarray(labels) != "Benign"):
+            identity = identity_of(rows[index])
+            label, score = str(labels[index]), float(scores[index])
+            key = identity["flow_id"] if identity["flow_id"] is not None else \
+                (identity["src_ip"], identity["src_port"], identity["dest_ip"], identity["dest_port"], identity["proto"])
+            if self._is_reported((key, label), now) or (key, label) in keys:
+                self.suppressed.inc()
+                continue
+            keys.add((key, label))
+            groups.setdefault(label, []).append(self._alert(identity, label, score))
+
+        records = []
+        for label, alerts in groups.items():
+            metrics.counter("barad_alerts", "Malicious flows reported.", label=label).inc(len(alerts))
+            if len(alerts) > self.summary_threshold:
+                records.append(self._summary(alerts, label))
+            else:
+                records.extend(alerts)
+        return records, keys
+
+    def add(self, rows: list, labels, scores, identity_of=flow_identity) -> int:
+        """
+        Writes the alert records of a window to the sink and returns how many were written.
+        The flows are only marked as reported once written, so a failed write is retried with
+        the next window reporting them.
+        """
+        records, keys = self.build(rows, labels, scores, identity_of)
+        if records:
+            try:
+                self.sink.write(records)
+            except Exception as e:
+                barad_logger.error("[ALR] Failed to write %d alert records: %s", len(records), str(e))
+                return 0
+            barad_logger.info("[ALR] %d alert records written", len(records))
+        self._mark_reported(keys, time.time())
+        return len(records)
+
+    def close(self):
+        self.sink.close()
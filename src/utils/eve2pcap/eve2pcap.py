@@ -28,9 +28,10 @@
 eve2pcap will convert the packets or the payloads found in an eve log
 file to a pcap file.
 
-Note that payload conversion requires Scapy, and will not recreate the
-original packets as the headers need to be built on the fly from the
-available information in the eve log.
+Note that payload conversion will not recreate the original packets, as
+the headers need to be built on the fly from the available information in
+the eve log. They are built by packet_builder, Scapy is only needed for
+the protocols it cannot build.
 
 """
 
@@ -41,127 +42,40 @@ import os
 import json
 import argparse
 import base64
+import logging
+import importlib.util
 from datetime import datetime
-import ctypes
-import ctypes.util
 from typing import List
 
-try:
-    from dateutil import parser
-except:
-    print("This application require the Python dateutil module.",
-          file=sys.stderr)
-    sys.exit(1)
-
-PCAP_ERRBUF_SIZE = 256
+from utils.timestamp import parse_timestamp
+from .packet_builder import build_packet
 
 DLT_EN10MB = 1
 DLT_RAW = 12
 
 DLT = {
     "DN10MB": DLT_EN10MB,
+    "EN10MB": DLT_EN10MB,
     "RAW": DLT_RAW,
 }
 
-libpcap_filename = ctypes.util.find_library("pcap")
-if not libpcap_filename:
-    has_libpcap = False
-else:
-    has_libpcap = True
-    libpcap = ctypes.cdll.LoadLibrary(libpcap_filename)
-    libpcap.pcap_geterr.restype = ctypes.c_char_p
-    libpcap.pcap_open_dead.restype = ctypes.POINTER(ctypes.c_void_p)
-    libpcap.pcap_dump_open.restype = ctypes.POINTER(ctypes.c_void_p)
-    pcap_errbuf = ctypes.create_string_buffer(PCAP_ERRBUF_SIZE)
-    libc = ctypes.cdll.LoadLibrary(ctypes.util.find_library("c"))
-
-# For now, Scapy is required for payload to packet conversion. And do
-# it quietly.
-try:
-    orig_stderr = sys.stderr
-    sys.stderr = open(os.devnull, "w")
-    from scapy.all import *
-    has_scapy = True
-except:
-    has_scapy = False
-finally:
-    sys.stderr = orig_stderr
-
-
-class pcap_pkthdr(ctypes.Structure):
-    """Internal class representing struct pcap_pkthdr. """
-    _fields_ = [
-        ("ts_sec", ctypes.c_ulong),
-        ("ts_usec", ctypes.c_ulong),
-        ("caplen", ctypes.c_uint32),
-        ("pktlen", ctypes.c_uint32),
-    ]
-
-class Pcap:
-
-    def __init__(self, pcap_t):
-        self._pcap_t = pcap_t
-
-    @classmethod
-    def open_dead(cls, linktype, snaplen):
-        pcap_t = libpcap.pcap_open_dead(linktype, snaplen)
-        if not pcap_t:
-            raise Exception(self.get_err().decode())
-        return cls(pcap_t)
-
-    def dump_open(self, filename):
-        if filename == "-":
-            return self.dump_fopen(sys.stdout.fileno())
-        pcap_dumper_t = libpcap.pcap_dump_open(
-            self._pcap_t, ctypes.c_char_p(filename.encode()))
-        if not pcap_dumper_t:
-            raise Exception(self.get_err().decode())
-        return PcapDumper(pcap_dumper_t)
-
-    def dump_fopen(self, fileno):
-        """Not quite a direct wrapper around pcap_dump_fopen - instead of a
-        file pointer, take a file descriptor.
-        """
-        fp = libc.fdopen(fileno, "w")
-        pcap_dumper_t = libpcap.pcap_dump_fopen(self._pcap_t, fp)
-        if not pcap_dumper_t:
-            raise Exception(self.get_err())
-        return PcapDumper(pcap_dumper_t)
-
-    def get_err(self):
-        return libpcap.pcap_geterr(self._pcap_t)
-
-class PcapDumper:
-    """ Minimal wrapper around pcap_dumper_t. """
-
-    def __init__(self, pcap_dumper_t):
-        self._pcap_dumper_t = pcap_dumper_t
-
-    def dump(self, pkthdr, packet):
-        libpcap.pcap_dump(self._pcap_dumper_t, ctypes.byref(pkthdr), packet)
-
-    def close(self):
-        libpcap.pcap_dump_close(self._pcap_dumper_t)
+# Payloads are turned into packets by packet_builder. Scapy is only a
+# fallback for the protocols it cannot build, so it is imported lazily;
+# its warnings are silenced once here, Scapy keeps a level already set.
+has_scapy = importlib.util.find_spec("scapy") is not None
+logging.getLogger("scapy").setLevel(logging.ERROR)
 
-def parse_timestamp(timestamp):
-    dt = parser.parse(timestamp)
-    return (int(dt.strftime("%s")), dt.microsecond)
 
 def eve2pcap(event):
     if not "packet" in event:
-        return None, None
+        return None
     packet = base64.b64decode(event["packet"])
-    hdr = pcap_pkthdr()
-    hdr.ts_sec, hdr.ts_usec = parse_timestamp(
-        event["timestamp"])
-    hdr.pktlen = len(packet)
-    hdr.caplen = len(packet)
-    return (hdr, packet)
+    ts_sec, ts_usec = parse_timestamp(event["timestamp"])
+    return (ts_sec, ts_usec, packet)
+
+def scapy_payload2packet(event, payload):
+    from scapy.all import IP, IPv6, TCP, UDP, ICMP
 
-def payload2packet(event):
-    if not "payload" in event:
-        return None, None
-    payload = base64.b64decode(event["payload"])
     if ':' in event["src_ip"]:
         packet = IPv6(src=event["src_ip"], dst=event["dest_ip"])
     else:
@@ -181,15 +95,20 @@ def payload2packet(event):
             pass
 
     packet = packet / payload
-    packet = packet.build()
+    return packet.build()
 
-    hdr = pcap_pkthdr()
-    hdr.ts_sec, hdr.ts_usec = parse_timestamp(
-        event["timestamp"])
-    hdr.pktlen = len(packet)
-    hdr.caplen = len(packet)
+def payload2packet(event):
+    if not "payload" in event:
+        return None
+    payload = base64.b64decode(event["payload"])
+    packet = build_packet(event, payload)
+    if packet is None:
+        if not has_scapy:
+            return None
+        packet = scapy_payload2packet(event, payload)
 
-    return (hdr, packet)
+    ts_sec, ts_usec = parse_timestamp(event["timestamp"])
+    return (ts_sec, ts_usec, packet)
 
 # -------------------------------------------------------------------------------------------------
 # The code below is not the original code from Jason Ish
@@ -197,9 +116,8 @@ def payload2packet(event):
 #
 # By Suga
 # -------------------------------------------------------------------------------------------------
-import logging
-
 from utils.monitoring import monitor_decorator
+from .pcap_writer import PcapWriter
 
 barad_logger = logging.getLogger("barad_logger")
 
@@ -207,32 +125,23 @@ class PcapConversionError(Exception):
     pass
 
 class PcapConverter:
-    def __init__(self, output_filename: str, dlt: str = None, payload: bool = False):
+    def __init__(self, output_filename: str = None, dlt: str = None, payload: bool = False):
         """
         Inizializza il convertitore PCAP.
 
-        :param output_filename: Nome del file di output.
+        :param output_filename: Nome del file di output, "-" per stdout, None per tenere il pcap in memoria.
         :param dlt: Tipo di DLT (e.g., "RAW", "EN10MB").
         :param payload: Se True, converte i payload invece dei pacchetti.
         """
-        if not has_libpcap:
-            raise PcapConversionError("Failed to load libpcap.")
-
-        if payload and not has_scapy:
-            raise PcapConversionError("Scapy is required for payload conversion.")
-
         self.output_filename = output_filename
         self.payload = payload
         self.dlt_value = self._determine_dlt(dlt, payload)
+        self.output = None
 
         if output_filename == "-" and os.isatty(sys.stdout.fileno()):
             raise PcapConversionError("Cowardly refusing to write output to terminal.")
 
-        try:
-            self.pcap = Pcap.open_dead(self.dlt_value, 65535)
-            self.dumper = self.pcap.dump_open(output_filename)
-        except Exception as e:
-            raise PcapConversionError(f"Failed to initialize PCAP writer: {str(e)}")
+        self.writer = PcapWriter(self.dlt_value, 65535)
 
     def _determine_dlt(self, dlt: str, payload: bool) -> int:
         """
@@ -253,31 +162,29 @@ class PcapConverter:
             return DLT_EN10MB
 
     @monitor_decorator(code_area="E2P")
-    def run(self, eves: List[dict]) -> int:
+    def run(self, eves: List[dict], output_filename: str = None) -> int:
         """
-        Converte gli eventi eve.json in un file pcap.
+        Converte gli eventi eve.json in un file pcap, riscritto a ogni chiamata.
+        Se l'output e' in memoria, il pcap resta disponibile in `self.output`.
 
         :param eves: Lista di eventi JSON (oggetti dict).
+        :param output_filename: File di output di questa chiamata, al posto di quello del convertitore.
         :return: Numero di eventi convertiti.
         """
-        count = 0
-
+        output_filename = output_filename if output_filename is not None else self.output_filename
         barad_logger.info(f"[E2P] Converting {len(eves)} eve records to pcap...")
+        convert = payload2packet if self.payload else eve2pcap
         try:
-            for event in eves:
-                hdr, packet = None, None
-                if self.payload:
-                    hdr, packet = payload2packet(event)
-                elif "packet" in event:
-                    hdr, packet = eve2pcap(event)
+            records = [record for record in map(convert, eves) if record is not None]
 
-                if hdr and packet:
-                    self.dumper.dump(hdr, ctypes.c_char_p(packet))
-                    count += 1
+            if output_filename is None:
+                self.output = self.writer.to_memory(records)
+            elif output_filename == "-":
+                self.writer.write(records, sys.stdout.buffer)
+            else:
+                self.writer.write(records, output_filename)
         except Exception as e:
             raise PcapConversionError(f"[E2P] Error during conversion: {str(e)}")
-        finally:
-            self.dumper.close()
 
-        barad_logger.info(f"[E2P] {count} eve records converted to pcap.")
-        return count
\ No newline at end of file
+        barad_logger.info(f"[E2P] {len(records)} eve records converted to pcap.")
+        return len(records)
@@ -0,0 +1,125 @@
+import sys
+import socket
+import struct
+from array import array
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_ICMPV6 = 58
+IPPROTO_NONE = 59
+
+PROTOCOLS = {
+    "TCP": IPPROTO_TCP,
+    "UDP": IPPROTO_UDP,
+    "ICMP": IPPROTO_ICMP,
+    "IPV6-ICMP": IPPROTO_ICMPV6,
+}
+
+# Header defaults are Scapy's, so synthesized packets match the ones it used to build.
+TTL = 64
+TCP_FLAGS = 0x02
+TCP_WINDOW = 8192
+
+_ipv4 = struct.Struct("!BBHHHBBH4s4s")
+_ipv6 = struct.Struct("!IHBB16s16s")
+_tcp = struct.Struct("!HHIIBBHHH")
+_udp = struct.Struct("!HHHH")
+_icmp = struct.Struct("!BBHHH")
+_ipv4_pseudo = struct.Struct("!4s4sBBH")
+_ipv6_pseudo = struct.Struct("!16s16sI3xB")
+_checksum = struct.Struct("!H")
+
+_little_endian = sys.byteorder == "little"
+
+
+def checksum(data) -> int:
+    """
+    Returns the internet checksum (RFC 1071) of data.
+    """
+    if len(data) % 2:
+        data = bytes(data) + b"\0"
+    words = array("H", data)
+    if _little_endian:
+        words.byteswap()
+    total = sum(words)
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def _set_checksum(segment: bytearray, offset: int, pseudo_header: bytes = b""):
+    _checksum.pack_into(segment, offset, checksum(pseudo_header + segment))
+
+
+def _transport(protocol: int, event: dict, payload: bytes, tcp_flags: int) -> bytearray:
+    """
+    Returns the transport header followed by the payload, with the checksum left to 0.
+    """
+    if protocol == IPPROTO_TCP:
+        segment = bytearray(_tcp.pack(event["src_port"], event["dest_port"], 0, 0,
+                                      5 << 4, tcp_flags, TCP_WINDOW, 0, 0))
+    elif protocol == IPPROTO_UDP:
+        segment = bytearray(_udp.pack(event["src_port"], event["dest_port"], _udp.size + len(payload), 0))
+    elif protocol in (IPPROTO_ICMP, IPPROTO_ICMPV6):
+        segment = bytearray(_icmp.pack(event.get("icmp_type", 0), event.get("icmp_code", 0), 0, 0, 0))
+    else:
+        return bytearray(payload)
+
+    segment += payload
+    return segment
+
+
+def build_packet(event: dict, payload: bytes, tcp_flags: int = TCP_FLAGS):
+    """
+    Builds the raw IPv4/IPv6 packet carrying the payload of an eve event, with
+    correct lengths and checksums. Returns None for protocols it cannot build.
+    """
+    proto = str(event.get("proto", "")).upper()
+    if proto in PROTOCOLS:
+        protocol = PROTOCOLS[proto]
+    elif proto.isdigit():
+        protocol = int(proto)
+    else:
+        return None
+
+    if ":" in event["src_ip"]:
+        src = socket.inet_pton(socket.AF_INET6, event["src_ip"])
+        dst = socket.inet_pton(socket.AF_INET6, event["dest_ip"])
+        segment = _transport(protocol, event, payload, tcp_flags)
+        length = len(segment)
+        pseudo_header = _ipv6_pseudo.pack(src, dst, length, protocol)
+
+        if protocol == IPPROTO_TCP:
+            _set_checksum(segment, 16, pseudo_header)
+        elif protocol == IPPROTO_UDP:
+            _set_checksum(segment, 6, pseudo_header)
+            if segment[6:8] == b"\0\0":
+                segment[6:8] = b"\xff\xff"
+        elif protocol == IPPROTO_ICMPV6:
+            _set_checksum(segment, 2, pseudo_header)
+        elif protocol == IPPROTO_ICMP:
+            _set_checksum(segment, 2)
+
+        return _ipv6.pack(6 << 28, length, protocol, TTL, src, dst) + segment
+
+    if protocol == IPPROTO_ICMPV6:
+        return None
+
+    src = socket.inet_aton(event["src_ip"])
+    dst = socket.inet_aton(event["dest_ip"])
+    segment = _transport(protocol, event, payload, tcp_flags)
+    length = len(segment)
+
+    if protocol == IPPROTO_TCP:
+        _set_checksum(segment, 16, _ipv4_pseudo.pack(src, dst, 0, protocol, length))
+    elif protocol == IPPROTO_UDP:
+        _set_checksum(segment, 6, _ipv4_pseudo.pack(src, dst, 0, protocol, length))
+        if segment[6:8] == b"\0\0":
+            segment[6:8] = b"\xff\xff"
+    elif protocol == IPPROTO_ICMP:
+        _set_checksum(segment, 2)
+
+    header = bytearray(_ipv4.pack(0x45, 0, _ipv4.size + length, 1, 0, TTL, protocol, 0, src, dst))
+    _set_checksum(header, 10)
+    return bytes(header + segment)
@@ -0,0 +1,58 @@
+import struct
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_VERSION = (2, 4)
+
+_global_header = struct.Struct("<IHHiIII")
+_record_header = struct.Struct("<IIII")
+
+
+class PcapWriter:
+    """
+    Writes pcap files without libpcap. The records of a run are serialized into a
+    single buffer and written with one call, to a file, to stdout or to memory.
+    """
+
+    def __init__(self, linktype: int, snaplen: int = 65535):
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.header = _global_header.pack(PCAP_MAGIC, *PCAP_VERSION, 0, 0, snaplen, linktype)
+
+    def serialize(self, records) -> bytearray:
+        """
+        Returns the pcap file of an iterable of (ts_sec, ts_usec, packet) records.
+        """
+        buffer = bytearray(self.header)
+        pack = _record_header.pack
+        snaplen = self.snaplen
+
+        for ts_sec, ts_usec, packet in records:
+            length = len(packet)
+            if length > snaplen:
+                buffer += pack(ts_sec, ts_usec, snaplen, length)
+                buffer += packet[:snaplen]
+            else:
+                buffer += pack(ts_sec, ts_usec, length, length)
+                buffer += packet
+
+        return buffer
+
+    def write(self, records, output) -> int:
+        """
+        Writes the records to `output`, a path or a binary file object, and returns the number of bytes written.
+        """
+        buffer = self.serialize(records)
+        if isinstance(output, (str, bytes)):
+            with open(output, "wb") as f:
+                f.write(buffer)
+        else:
+            output.write(buffer)
+            output.flush()
+        return len(buffer)
+
+    def to_memory(self, records) -> memoryview:
+        """
+        Returns the pcap file of the records as a read-only view, without writing it anywhere.
+        """
+        return memoryview(self.serialize(records)).toreadonly()
+
@@ -0,0 +1,3 @@
+from .flowmeter import FlowFeatureExtractor, FeatureExtractionError
+from .flow_table import FlowTable
+from .flow_hash import flow_hash
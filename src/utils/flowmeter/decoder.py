@@ -0,0 +1,165 @@
+import struct
+import socket
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+# DLT_RAW is 12 on most platforms and 14 on OpenBSD, both mean raw IP.
+RAW_LINKTYPES = (12, 14, LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6)
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+VLAN_ETHERTYPES = (0x8100, 0x88A8, 0x9100)
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+TCP_URG = 0x20
+TCP_ECE = 0x40
+TCP_CWR = 0x80
+
+_ethertype = struct.Struct("!H")
+_ipv4 = struct.Struct("!BBHHHBBH4s4s")
+_ipv6 = struct.Struct("!IHBB16s16s")
+_ports = struct.Struct("!HH")
+
+
+class DecodedPacket:
+    """
+    Network and transport layer fields of a packet needed to compute flow features.
+    """
+    __slots__ = ("timestamp", "src_ip", "dst_ip", "src_port", "dst_port", "protocol",
+                 "length", "header_length", "payload_length", "flags")
+
+    def __init__(self, timestamp, src_ip, dst_ip, src_port, dst_port, protocol,
+                 length, header_length, payload_length, flags):
+        self.timestamp = timestamp
+        self.src_ip = src_ip
+        self.dst_ip = dst_ip
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.protocol = protocol
+        self.length = length
+        self.header_length = header_length
+        self.payload_length = payload_length
+        self.flags = flags
+
+
+def _strip_link_layer(data: bytes, linktype: int):
+    """
+    Returns the offset of the network layer in the frame, or None if it is not IP.
+    """
+    if linktype in RAW_LINKTYPES:
+        return 0
+
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        ethertype, = _ethertype.unpack_from(data, offset)
+        while ethertype in VLAN_ETHERTYPES:
+            offset += 4
+            ethertype, = _ethertype.unpack_from(data, offset)
+        if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+        return offset + 2
+
+    if linktype == LINKTYPE_LINUX_SLL:
+        ethertype, = _ethertype.unpack_from(data, 14)
+        if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+        return 16
+
+    return None
+
+
+def decode_packet(timestamp: float, data: bytes, linktype: int = LINKTYPE_ETHERNET):
+    """
+    Decodes a captured frame into a DecodedPacket, or returns None if it is not a TCP/UDP IP packet.
+    """
+    try:
+        offset = _strip_link_layer(data, linktype)
+        if offset is None:
+            return None
+
+        version = data[offset] >> 4
+        if version == 4:
+            version_ihl, _, total_length, _, _, _, protocol, _, src, dst = _ipv4.unpack_from(data, offset)
+            ip_header_length = (version_ihl & 0x0F) * 4
+            src_ip = socket.inet_ntop(socket.AF_INET, src)
+            dst_ip = socket.inet_ntop(socket.AF_INET, dst)
+        elif version == 6:
+            _, payload_length, protocol, _, src, dst = _ipv6.unpack_from(data, offset)
+            total_length = payload_length + 40
+            ip_header_length = 40
+            while protocol in IPV6_EXTENSION_HEADERS:
+                protocol = data[offset + ip_header_length]
+                ip_header_length += (data[offset + ip_header_length + 1] + 1) * 8
+            src_ip = socket.inet_ntop(socket.AF_INET6, src)
+            dst_ip = socket.inet_ntop(socket.AF_INET6, dst)
+        else:
+            return None
+
+        transport = offset + ip_header_length
+        if protocol == PROTO_TCP:
+            src_port, dst_port = _ports.unpack_from(data, transport)
+            transport_header_length = (data[transport + 12] >> 4) * 4
+            flags = data[transport + 13]
+        elif protocol == PROTO_UDP:
+            src_port, dst_port = _ports.unpack_from(data, transport)
+            transport_header_length = 8
+            flags = 0
+        else:
+            return None
+
+    except (IndexError, struct.error, ValueError):
+        return None
+
+    header_length = ip_header_length + transport_header_length
+    return DecodedPacket(timestamp, src_ip, dst_ip, src_port, dst_port, protocol,
+                         total_length, header_length, max(total_length - header_length, 0), flags)
+
+
+def frame_flow_key(data: bytes, linktype: int = LINKTYPE_ETHERNET):
+    """
+    Returns the direction-independent 5-tuple of a frame as raw header bytes, or None if it
+    is not a TCP/UDP IP packet. Cheaper than decode_packet when only the flow is needed.
+    """
+    try:
+        offset = _strip_link_layer(data, linktype)
+        if offset is None:
+            return None
+
+        version = data[offset] >> 4
+        if version == 4:
+            ip_header_length = (data[offset] & 0x0F) * 4
+            protocol = data[offset + 9]
+            src, dst = data[offset + 12:offset + 16], data[offset + 16:offset + 20]
+        elif version == 6:
+            ip_header_length = 40
+            protocol = data[offset + 6]
+            while protocol in IPV6_EXTENSION_HEADERS:
+                protocol = data[offset + ip_header_length]
+                ip_header_length += (data[offset + ip_header_length + 1] + 1) * 8
+            src, dst = data[offset + 8:offset + 24], data[offset + 24:offset + 40]
+        else:
+            return None
+
+        if protocol not in (PROTO_TCP, PROTO_UDP):
+            return None
+        transport = offset + ip_header_length
+        ports = data[transport:transport + 4]
+        if len(ports) < 4:
+            return None
+    except (IndexError, struct.error):
+        return None
+
+    a, b = src + ports[:2], dst + ports[2:]
+    return bytes((protocol,)) + (a + b if a <= b else b + a)
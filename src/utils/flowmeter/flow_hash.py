@@ -0,0 +1,42 @@
+import re
+import json
+import zlib
+
+from .decoder import frame_flow_key
+
+_raw_flow_id = re.compile(rb'"flow_id"\s*:\s*(\d+)')
+
+
+def flow_hash(event, linktype: int = None) -> int:
+    """
+    Returns a 32-bit hash of the flow of a packet, stable across processes unlike hash():
+    the crc32 of the Suricata flow_id, or else of the direction-independent 5-tuple,
+    so both directions of a flow get the same hash.
+
+    :param event: Eve record (dict, or raw JSON bytes hashed on their flow_id without decoding
+        them), or (timestamp, frame) pair if linktype is given, hashed on the raw header bytes of
+        the frame without decoding it.
+    """
+    if linktype is not None:
+        key = frame_flow_key(event[1], linktype)
+        return zlib.crc32(key) if key is not None else 0
+
+    if isinstance(event, (bytes, str)):
+        raw = event.encode() if isinstance(event, str) else event
+        match = _raw_flow_id.search(raw)
+        if match:
+            return zlib.crc32(match[1])
+        try:
+            event = json.loads(raw)
+        except ValueError:
+            return 0
+        if not isinstance(event, dict):
+            return 0
+
+    flow_id = event.get("flow_id")
+    if flow_id is not None:
+        return zlib.crc32(str(flow_id).encode())
+
+    a = (event.get("src_ip"), event.get("src_port"))
+    b = (event.get("dest_ip"), event.get("dest_port"))
+    return zlib.crc32(repr((event.get("proto"),) + (a + b if a <= b else b + a)).encode())
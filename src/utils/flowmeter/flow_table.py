@@ -0,0 +1,108 @@
+import time
+import logging
+from collections import OrderedDict
+
+from .flowmeter import Flow, flow_key, TRACKED_SERIES
+
+barad_logger = logging.getLogger("barad_logger")
+
+
+class FlowTable:
+    """
+    Flow table kept across detection windows, so flows spanning several windows are
+    analysed as a whole. Flows are emitted when they finish (FIN in both directions
+    or RST), when they are idle or active for too long, or when the table is full.
+
+    The clock follows the packet timestamps, and moves on with the wall time between two
+    windows, so idle flows expire even when the packets of the window are older.
+    """
+
+    def __init__(self, idle_timeout: float = 120, active_timeout: float = 1800, max_flows: int = 100000):
+        if max_flows < 1:
+            raise ValueError("max_flows must be a positive integer.")
+
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.flows = OrderedDict()
+        self.clock = 0.0
+        self._clock_wall = None
+        barad_logger.debug("[FFE] FlowTable initialized with idle timeout: %s, active timeout: %s, max flows: %d",
+                          idle_timeout, active_timeout, max_flows)
+
+    def __len__(self):
+        return len(self.flows)
+
+    @staticmethod
+    def _key(packet, flow_id):
+        return flow_id if flow_id is not None else flow_key(packet)
+
+    def add(self, packet, flow_id=None, tracked=TRACKED_SERIES) -> Flow:
+        """
+        Adds a decoded packet to its flow, creating the flow if needed.
+        """
+        key = self._key(packet, flow_id)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = Flow(packet, flow_id, tracked)
+        else:
+            self.flows.move_to_end(key)
+        flow.add_packet(packet)
+        self.clock = max(self.clock, packet.timestamp)
+        return flow
+
+    def tick(self, packets_advanced: bool = False):
+        """
+        Advances the clock by the wall time elapsed since the previous window, unless
+        the packets of this window already moved it forward.
+        """
+        now = time.monotonic()
+        if self._clock_wall is not None and not packets_advanced:
+            self.clock += now - self._clock_wall
+        self._clock_wall = now
+
+    def expire(self) -> list:
+        """
+        Removes and returns the finished, idle and overly long flows, then the least
+        recently updated ones until the table fits in `max_flows`.
+        """
+        expired = []
+        for key, flow in list(self.flows.items()):
+            if (flow.finished
+                    or self.clock - flow.last_seen >= self.idle_timeout
+                    or flow.last_seen - flow.start_time >= self.active_timeout):
+                expired.append(self.flows.pop(key))
+
+        while len(self.flows) > self.max_flows:
+            _, flow = self.flows.popitem(last=False)
+            expired.append(flow)
+
+        return expired
+
+    def update(self, decoded, emit_updates: bool = False, tracked=TRACKED_SERIES) -> list:
+        """
+        Adds a window of decoded packets and returns the flows to analyse: the expired
+        ones and, if `emit_updates` is set, the active flows updated by the window.
+        """
+        updated = {}
+        clock = self.clock
+        for packet, flow_id in decoded:
+            flow = self.add(packet, flow_id, tracked)
+            updated[id(flow)] = flow
+        self.tick(packets_advanced=self.clock > clock)
+
+        flows = self.expire()
+        if emit_updates:
+            expired = {id(flow) for flow in flows}
+            flows.extend(flow for key, flow in updated.items() if key not in expired)
+
+        barad_logger.info("[FFE] %d flows emitted, %d flows still tracked", len(flows), len(self.flows))
+        return flows
+
+    def flush(self) -> list:
+        """
+        Removes and returns every flow in the table.
+        """
+        flows = list(self.flows.values())
+        self.flows.clear()
+        return flows
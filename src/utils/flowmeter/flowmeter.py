@@ -0,0 +1,345 @@
+import re
+import math
+import base64
+import logging
+import numpy as np
+from typing import List
+
+from utils.monitoring import monitor_decorator
+from utils.timestamp import parse_event_timestamp
+from .decoder import decode_packet, LINKTYPE_ETHERNET
+from .decoder import TCP_FIN, TCP_SYN, TCP_RST, TCP_PSH, TCP_ACK, TCP_URG, TCP_ECE, TCP_CWR
+
+barad_logger = logging.getLogger("barad_logger")
+
+
+class FeatureExtractionError(Exception):
+    pass
+
+
+FWD = 0
+BWD = 1
+# Index of the statistics over both directions.
+BOTH = 2
+
+FLAGS = {
+    "fin": TCP_FIN,
+    "syn": TCP_SYN,
+    "rst": TCP_RST,
+    "psh": TCP_PSH,
+    "ack": TCP_ACK,
+    "urg": TCP_URG,
+    "ece": TCP_ECE,
+    "cwr": TCP_CWR,
+}
+
+STATISTICS = {
+    "mean": lambda stats: stats.mean,
+    "std": lambda stats: math.sqrt(stats.m2 / stats.count),
+    "variance": lambda stats: stats.m2 / stats.count,
+    "max": lambda stats: stats.maximum,
+    "min": lambda stats: stats.minimum,
+    "total": lambda stats: stats.total,
+}
+
+# Names follow the NTLFlowLyzer output: a statistic can be written as a prefix
+# ("min_header_bytes", "max_bwd_packets_delta_len") or as a suffix
+# ("payload_bytes_std", "bwd_packets_IAT_variance").
+# Each series is a packet field, or the differences between consecutive values of the field.
+SERIES = {
+    "payload_bytes_delta_len": ("payload_length", True),
+    "packets_delta_len": ("length", True),
+    "payload_bytes": ("payload_length", False),
+    "header_bytes": ("header_length", False),
+    "packets_len": ("length", False),
+    "packets_IAT": ("timestamp", True),
+    "packet_IAT": ("timestamp", True),
+}
+TRACKED_SERIES = tuple(sorted({series + (direction,) for series in SERIES.values() for direction in (FWD, BWD, BOTH)}))
+
+_stat_names = "|".join(STATISTICS)
+_series_names = "|".join(sorted(SERIES, key=len, reverse=True))
+_series_feature = re.compile(
+    rf"^(?:(?P<prefix>{_stat_names})_)?(?:(?P<direction>fwd|bwd)_)?(?P<series>{_series_names})(?:_(?P<suffix>{_stat_names}))?$")
+_flag_feature = re.compile(rf"^(?:(?P<direction>fwd|bwd)_)?(?P<flag>{'|'.join(FLAGS)})_flag_counts$")
+_count_feature = re.compile(r"^(?:(?P<direction>fwd|bwd)_)?packets_count$")
+
+DIRECTIONS = {None: BOTH, "fwd": FWD, "bwd": BWD}
+
+
+def _series_statistic(series, statistic, direction):
+    def feature(flow):
+        stats = flow.statistics(series, direction)
+        return float(statistic(stats)) if stats.count else 0.0
+    return feature
+
+
+def _flag_count(flag, direction):
+    def feature(flow):
+        return float(flow.flag_count(flag, direction))
+    return feature
+
+
+def _packet_count(direction):
+    def feature(flow):
+        return float(flow.statistics("packets_len", direction).count)
+    return feature
+
+
+def parse_feature(name: str):
+    """
+    Returns a function computing the named feature from a Flow, or None if the name is not supported.
+    """
+    if name == "duration":
+        return lambda flow: flow.last_seen - flow.start_time
+
+    match = _series_feature.match(name)
+    if match and bool(match["prefix"]) != bool(match["suffix"]):
+        statistic = STATISTICS[match["prefix"] or match["suffix"]]
+        return _series_statistic(match["series"], statistic, DIRECTIONS[match["direction"]])
+
+    match = _flag_feature.match(name)
+    if match:
+        return _flag_count(FLAGS[match["flag"]], DIRECTIONS[match["direction"]])
+
+    match = _count_feature.match(name)
+    if match:
+        return _packet_count(DIRECTIONS[match["direction"]])
+
+    return None
+
+
+def feature_series(name: str):
+    """
+    Returns the series the named feature is computed from, as (field, delta, direction), or None.
+    """
+    match = _series_feature.match(name)
+    if match and bool(match["prefix"]) != bool(match["suffix"]):
+        return SERIES[match["series"]] + (DIRECTIONS[match["direction"]],)
+    match = _count_feature.match(name)
+    if match:
+        return SERIES["packets_len"] + (DIRECTIONS[match["direction"]],)
+    return None
+
+
+class RunningStatistics:
+    """
+    Count, total, mean, variance (Welford), min and max of a series, updated value by value.
+    """
+    __slots__ = ("count", "total", "mean", "m2", "minimum", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+
+class Flow:
+    """
+    Bidirectional flow; the sender of the first packet is the forward direction.
+
+    Packets are not stored: each one updates the running statistics of its direction and
+    of both directions, so a flow takes constant memory and its features constant time.
+    Only the `tracked` (field, delta, direction) series are kept, see feature_series.
+    """
+
+    def __init__(self, packet, flow_id=None, tracked=TRACKED_SERIES):
+        self.src_ip = packet.src_ip
+        self.src_port = packet.src_port
+        self.dst_ip = packet.dst_ip
+        self.dst_port = packet.dst_port
+        self.protocol = packet.protocol
+        self.flow_id = flow_id
+        self.start_time = packet.timestamp
+        self.last_seen = packet.timestamp
+        self.finished = False
+        self._fin = [False, False]
+        self._stats = [{}, {}, {}]
+        for field, delta, direction in tracked:
+            self._stats[direction][field, delta] = RunningStatistics()
+        self._last = [None, None, None]
+        self._flags = [{}, {}, {}]
+
+    def add_packet(self, packet):
+        """
+        Adds a packet of this flow.
+        """
+        direction = FWD if (packet.src_ip, packet.src_port) == (self.src_ip, self.src_port) else BWD
+        flags = packet.flags
+        for index in (direction, BOTH):
+            last = self._last[index]
+            for (field, delta), stats in self._stats[index].items():
+                if not delta:
+                    stats.add(getattr(packet, field))
+                elif last is not None:
+                    stats.add(getattr(packet, field) - getattr(last, field))
+            self._last[index] = packet
+
+            # Counted per flags byte, at most 256 entries; flag_count sums the bytes holding a flag.
+            if flags:
+                counts = self._flags[index]
+                counts[flags] = counts.get(flags, 0) + 1
+
+        self.start_time = min(self.start_time, packet.timestamp)
+        self.last_seen = max(self.last_seen, packet.timestamp)
+
+        if flags & TCP_FIN:
+            self._fin[direction] = True
+        if flags & TCP_RST or all(self._fin):
+            self.finished = True
+
+    def flag_count(self, flag: int, direction: int = BOTH) -> int:
+        """
+        Returns the number of packets carrying a TCP flag, in one direction or in both.
+        """
+        return sum(count for flags, count in self._flags[direction].items() if flags & flag)
+
+    def statistics(self, series: str, direction: int = BOTH) -> RunningStatistics:
+        """
+        Returns the running statistics of a series, for one direction or for both.
+        """
+        return self._stats[direction][SERIES[series]]
+
+
+def flow_key(packet):
+    """
+    Returns the direction-independent 5-tuple key of a packet.
+    """
+    a = (packet.src_ip, packet.src_port)
+    b = (packet.dst_ip, packet.dst_port)
+    return (packet.protocol,) + (a + b if a <= b else b + a)
+
+
+class FlowFeatureExtractor:
+    """
+    Computes the selected flow features straight from the packets of eve records,
+    without writing a pcap or a CSV file.
+    """
+
+    def __init__(self, selected_features: list, flow_table=None, emit_updates: bool = False):
+        """
+        :param selected_features: Names of the features to compute, in model order.
+        :param flow_table: FlowTable kept across windows; if None, each window is analysed on its own.
+        :param emit_updates: With a flow table, also emit the flows still active that were updated in the window.
+        """
+        self.selected_features = list(selected_features)
+        self.flow_table = flow_table
+        self.emit_updates = emit_updates
+        self.features = [parse_feature(name) for name in self.selected_features]
+        self.tracked = tuple(sorted({series for series in map(feature_series, self.selected_features) if series is not None}))
+
+        unsupported = [name for name, feature in zip(self.selected_features, self.features) if feature is None]
+        if unsupported:
+            raise FeatureExtractionError(f"The following features are not supported by the native extractor: {unsupported}")
+
+
+    def decode_events(self, eves: List[dict]):
+        """
+        Decodes the packets of the eve records, sorted by timestamp.
+        """
+        decoded = []
+        for event in eves:
+            if "packet" not in event:
+                continue
+
+            linktype = event.get("packet_info", {}).get("linktype", LINKTYPE_ETHERNET)
+            timestamp = parse_event_timestamp(event["timestamp"])
+            packet = decode_packet(timestamp, base64.b64decode(event["packet"]), linktype)
+            if packet is not None:
+                decoded.append((packet, event.get("flow_id")))
+
+        decoded.sort(key=lambda item: item[0].timestamp)
+        return decoded
+
+
+    def decode_frames(self, frames: list, linktype: int):
+        """
+        Decodes (timestamp, frame) pairs read from a capture file.
+        """
+        decoded = []
+        for timestamp, frame in frames:
+            packet = decode_packet(timestamp, frame, linktype)
+            if packet is not None:
+                decoded.append((packet, None))
+
+        decoded.sort(key=lambda item: item[0].timestamp)
+        return decoded
+
+
+    def build_flows(self, decoded) -> dict:
+        """
+        Groups decoded packets into bidirectional flows.
+        """
+        flows = {}
+        for packet, flow_id in decoded:
+            key = flow_key(packet)
+            flow = flows.get(key)
+            if flow is None:
+                flow = flows[key] = Flow(packet, flow_id, self.tracked)
+            flow.add_packet(packet)
+        return flows
+
+
+    def compute_features(self, flows: List[Flow]) -> np.ndarray:
+        """
+        Returns a (flows x selected features) float32 matrix.
+        """
+        features = np.zeros((len(flows), len(self.features)), dtype=np.float32)
+        for i, flow in enumerate(flows):
+            features[i] = [feature(flow) for feature in self.features]
+        return features
+
+
+    @monitor_decorator(code_area="FFE")
+    def run(self, eves: List[dict], linktype: int = None):
+        """
+        Extracts the selected features of every flow in the eve records.
+
+        :param eves: List of eve records (dict objects), or of (timestamp, frame) pairs if linktype is given.
+        :param linktype: Link type of the frames read from a capture file.
+        :return: Feature matrix and the flows of its rows.
+        """
+        barad_logger.info(f"[FFE] Extracting features from {len(eves)} records...")
+
+        decoded = self.decode_events(eves) if linktype is None else self.decode_frames(eves, linktype)
+        if self.flow_table is None:
+            flows = list(self.build_flows(decoded).values())
+        else:
+            flows = self.flow_table.update(decoded, self.emit_updates, self.tracked)
+
+        features = self.compute_features(flows)
+
+        barad_logger.info(f"[FFE] {len(flows)} flows extracted.")
+        return features, flows
+
+
+    def expire(self):
+        """
+        Extracts the features of the flows of the flow table expired by the time passed
+        since the last window, when no packets arrived.
+        """
+        flows = self.flow_table.update([], tracked=self.tracked) if self.flow_table is not None else []
+        return self.compute_features(flows), flows
+
+
+    def flush(self):
+        """
+        Extracts the features of the flows left in the flow table.
+        """
+        flows = self.flow_table.flush() if self.flow_table is not None else []
+        barad_logger.info(f"[FFE] {len(flows)} flows flushed.")
+        return self.compute_features(flows), flows
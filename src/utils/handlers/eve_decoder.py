@@ -0,0 +1,78 @@
+import json
+import logging
+
+from utils.monitoring import metrics
+
+try:
+    import orjson
+    has_orjson = True
+except ImportError:
+    has_orjson = False
+
+barad_logger = logging.getLogger("barad_logger")
+
+# Keys of the eve records used after decoding: packet conversion, flow extraction and alerts.
+RECORD_KEYS = (
+    "timestamp", "flow_id", "event_type", "src_ip", "src_port", "dest_ip", "dest_port", "proto",
+    "icmp_type", "icmp_code", "packet", "packet_info", "payload",
+)
+
+
+class EveDecoder:
+    """
+    Decodes raw eve records, keeping only the ones carrying `field`.
+
+    Records are rejected on their raw bytes before any JSON decoding, so flow, stats,
+    dns and the other non-packet events cost a substring search instead of a parse.
+    Kept records are decoded with orjson when installed and reduced to RECORD_KEYS;
+    malformed records are counted as rejected and skipped.
+    """
+
+    def __init__(self, field: str = "packet", keys: tuple = RECORD_KEYS, area: str = "ingestion", raw: bool = False):
+        """
+        :param field: Field a record must carry to be kept ("packet", or "payload" for payload mode).
+        :param keys: Keys kept in the decoded records, None to keep whole records.
+        :param area: Code area of the handler, labelling the skipped records metric.
+        :param raw: Only filter the records on their raw bytes and keep them undecoded, for the
+            shard workers to decode them.
+        """
+        self.field = field
+        self.raw = raw
+        self.area = area
+        self.keys = keys
+        self.marker = f'"{field}"'.encode()
+        self.loads = orjson.loads if has_orjson else json.loads
+        self.rejected = metrics.counter("barad_skipped_records", "Eve records skipped: without the field, or malformed.", area=area)
+
+    def decode(self, raw):
+        """
+        Returns the compact record of a raw eve record (the raw record itself in raw mode),
+        or None if it is rejected.
+        """
+        if isinstance(raw, str):
+            raw = raw.encode()
+        if self.marker not in raw:
+            self.rejected.inc()
+            return None
+        if self.raw:
+            return raw
+
+        try:
+            event = self.loads(raw)
+        except (ValueError, TypeError) as e:
+            self.rejected.inc()
+            barad_logger.warning("[%s] Skipping malformed eve record: %s", self.area, str(e))
+            return None
+        if not isinstance(event, dict) or self.field not in event:
+            self.rejected.inc()
+            return None
+        if self.keys is None:
+            return event
+        return {key: event[key] for key in self.keys if key in event}
+
+    def decode_many(self, raws) -> list:
+        """
+        Returns the compact records of the raw eve records that are kept.
+        """
+        decode = self.decode
+        return [event for event in map(decode, raws) if event is not None]
@@ -0,0 +1,185 @@
+import os
+import gzip
+import time
+
+from utils.logger import logging
+from utils.monitoring import metrics
+from utils.timestamp import TimestampError, parse_event_timestamp
+from utils.handlers.packet_handler import PacketContext
+from utils.handlers.packet_handler import PacketHandler
+from utils.handlers.eve_decoder import EveDecoder
+
+barad_logger = logging.getLogger("barad_logger")
+
+
+def find_eve_files(path: str) -> list:
+    """
+    Returns the eve files of a directory, oldest first, or the path itself if it is a file.
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    files = [os.path.join(path, name) for name in os.listdir(path)
+             if name.startswith("eve") and ".json" in name]
+    return sorted(files, key=os.path.getmtime)
+
+
+class EveFilePacketHandler(PacketHandler):
+    """
+    Replays Suricata eve.json files (plain or gzipped, or a directory of rotated ones)
+    through the observers, at maximum speed or paced on the recorded timestamps.
+    Windows close after `chunk_size` packet events or `timeout` seconds of recorded time.
+    """
+
+    def __init__(self, path, chunk_size=5000, timeout=10, speed=0.0, field="packet"):
+        """
+        :param speed: Replay speed relative to the recorded timestamps; 0 replays as fast as possible.
+        :param field: Field an event must carry to be replayed ("packet", or "payload" for payload mode).
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer.")
+        if speed < 0:
+            raise ValueError("speed must be positive, or 0 for maximum speed.")
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.speed = speed
+        self.decoder = EveDecoder(field, area="HES")
+        self.observers = []
+        self.windows = metrics.counter("barad_windows", "Windows handed to the observers.", area="HES")
+        self.ingested = metrics.counter("barad_ingested_packets", "Packet records handed to the observers.", area="HES")
+        self._replay_start = None
+        barad_logger.debug("[HES] EveFilePacketHandler initialized with path: %s, chunk size: %d, speed: %s",
+                          path, chunk_size, speed)
+
+
+    def register_observer(self, observer):
+        """
+        Registers an observer for notification.
+        """
+        barad_logger.debug("[HES] Observer registered: %s", observer)
+        self.observers.append(observer)
+
+
+    def remove_observer(self, observer):
+        """
+        Removes an observer from the list.
+        """
+        barad_logger.debug("[HES] Observer removed: %s", observer)
+        self.observers.remove(observer)
+
+
+    def notify_observer(self, context):
+        """
+        Notifies all registered observers.
+        """
+        barad_logger.debug("[HES] Notifying observers with context: %s", context)
+        for observer in self.observers:
+            barad_logger.debug("[HES] Observer %s notified", observer)
+            observer.update(context)
+
+
+    def __notify(self, context):
+        """
+        Notifies the observers of a window, releasing it so its done callbacks run even on error.
+        """
+        context.retain()
+        try:
+            self.notify_observer(context)
+        except Exception as e:
+            context.release(e)
+            raise
+        context.release()
+
+
+    def __read_events(self):
+        """
+        Yields the events of the eve files carrying the replayed field, with their timestamp.
+        Events without a valid timestamp are counted as rejected and skipped.
+        """
+        for file in find_eve_files(self.path):
+            barad_logger.info("[HES] Replaying %s", file)
+            opener = gzip.open if file.endswith(".gz") else open
+            with opener(file, "rb") as f:
+                for line in f:
+                    event = self.decoder.decode(line)
+                    if event is None:
+                        continue
+                    try:
+                        timestamp = parse_event_timestamp(event["timestamp"])
+                    except (KeyError, TypeError, TimestampError) as e:
+                        self.decoder.rejected.inc()
+                        barad_logger.warning("[HES] Skipping eve record without a valid timestamp: %s", str(e))
+                        continue
+                    yield event, timestamp
+
+
+    def __pace(self, timestamp: float):
+        """
+        Waits until the recorded timestamp is due at the replay speed.
+        """
+        if not self.speed:
+            return
+
+        if self._replay_start is None:
+            self._replay_start = (time.time(), timestamp)
+            return
+
+        wall_start, recorded_start = self._replay_start
+        delay = wall_start + (timestamp - recorded_start) / self.speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def __fetch_packets(self):
+        """
+        Yields windows of events.
+        """
+        window, window_start = [], None
+        for event, timestamp in self.__read_events():
+            if window and (len(window) >= self.chunk_size or timestamp - window_start >= self.timeout):
+                yield window
+                window = []
+
+            self.__pace(timestamp)
+            if not window:
+                window_start = timestamp
+            window.append(event)
+
+        if window:
+            yield window
+
+
+    def process_packets(self):
+        """
+        Replays the packets of the eve files.
+        """
+        barad_logger.info("[HES] Starting eve replay")
+        start_time, count = time.time(), 0
+        try:
+            for packets in self.__fetch_packets():
+                count += len(packets)
+                self.windows.inc()
+                self.ingested.inc(len(packets))
+                barad_logger.info("[HES] Processing %d packets (%d so far)", len(packets), count)
+                # A failed window is logged and the replay goes on with the next one.
+                try:
+                    self.__notify(PacketContext(packets))
+                except Exception as e:
+                    barad_logger.error("[HES] Error processing a window of %d packets: %s", len(packets), str(e))
+            self.__notify(PacketContext([], {"flush": True}))
+
+        except Exception as e:
+            barad_logger.error("[HES] Error processing packets: %s", str(e))
+
+        elapsed_time = time.time() - start_time
+        barad_logger.info("[HES] Replayed %d packets in %.2f seconds (%.0f packets/s)",
+                         count, elapsed_time, count / elapsed_time if elapsed_time else 0)
+
+
+    def run(self):
+        """
+        Runs the packet processing pipeline on the eve files.
+        """
+        self.process_packets()
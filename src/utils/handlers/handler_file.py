@@ -1,19 +1,31 @@
 import os
-import json
 from utils.handlers.packet_handler import PacketHandler, PacketContext
+from utils.handlers.pcap_reader import PcapReader
 from utils.logger import logging
+from utils.monitoring import metrics
 
 file_logger = logging.getLogger("barad_logger")
 
 class FilePacketHandler(PacketHandler):
     """
     File packet handler that implements the Observer pattern to notify changes.
+
+    Without `chunk_size` the observers are notified once and read the file themselves.
+    With `chunk_size` the file is streamed through a memory map and the observers are
+    notified with each chunk of (timestamp, frame) pairs, then once more with
+    `metadata["flush"]` set at the end of the file.
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, chunk_size=None):
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer.")
+
         self.file_path = file_path
+        self.chunk_size = chunk_size
         self.observers = []
-        file_logger.debug("[HFS] FilePacketHandler initialized with file path: %s", file_path)
+        self.windows = metrics.counter("barad_windows", "Windows handed to the observers.", area="HFS")
+        self.ingested = metrics.counter("barad_ingested_packets", "Packet records handed to the observers.", area="HFS")
+        file_logger.debug("[HFS] FilePacketHandler initialized with file path: %s, chunk size: %s", file_path, chunk_size)
 
     def register_observer(self, observer):
         """
@@ -38,11 +50,26 @@ class FilePacketHandler(PacketHandler):
             observer.update(context)
             file_logger.debug("[HFS] Observer %s notified", observer)
 
+    def __notify(self, context):
+        """
+        Notifies the observers of a chunk, releasing it so its done callbacks run even on error.
+        """
+        context.retain()
+        try:
+            self.notify_observer(context)
+        except Exception as e:
+            context.release(e)
+            raise
+        context.release()
+
     def __fetch_packets(self):
         """
-        Reads all packets from the file.
+        Reads the packets of the file chunk by chunk.
         """
-        pass
+        with PcapReader(self.file_path) as reader:
+            file_logger.info("[HFS] Reading %s with linktype %d", self.file_path, reader.linktype)
+            for chunk in reader.chunks(self.chunk_size):
+                yield PacketContext(chunk, {"linktype": reader.linktype})
 
     def process_packets(self):
         """
@@ -50,8 +77,27 @@ class FilePacketHandler(PacketHandler):
         """
         file_logger.info("[HFS] Starting packet processing")
         try:
-            if os.path.exists(self.file_path):
-                os.system(f"cp {self.file_path} ./.temp/output.pcap")
-                self.notify_observer()
+            if not os.path.exists(self.file_path):
+                file_logger.error("[HFS] File not found: %s", self.file_path)
+                return
+
+            if self.chunk_size is None:
+                self.__notify(PacketContext([]))
+                return
+
+            count = 0
+            for context in self.__fetch_packets():
+                count += len(context.packets)
+                self.windows.inc()
+                self.ingested.inc(len(context.packets))
+                file_logger.info("[HFS] Processing %d packets (%d so far)", len(context.packets), count)
+                self.__notify(context)
+            self.__notify(PacketContext([], {"flush": True}))
         except Exception as e:
             file_logger.error("[HFS] Error processing packets: %s", str(e))
+
+    def run(self):
+        """
+        Runs the packet processing pipeline on the file.
+        """
+        self.process_packets()
@@ -1,27 +1,90 @@
 import redis
-import json
 import time
+import socket
+import itertools
 
 from utils.logger import logging
+from utils.monitoring import metrics
 from utils.handlers.packet_handler import PacketContext
 from utils.handlers.packet_handler import PacketHandler 
+from utils.handlers.eve_decoder import EveDecoder
+from utils.handlers.load_shedding import AdaptiveScheduler, LoadShedder
 
 barad_logger = logging.getLogger("barad_logger")
 
+# Moves up to ARGV[1] records from the head of the list to the batch list and registers
+# the batch as in flight, atomically, in one round-trip.
+MOVE_CHUNK_SCRIPT = """
+local records = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #records > 0 then
+    redis.call('LTRIM', KEYS[1], #records, -1)
+    for start = 1, #records, 5000 do
+        redis.call('RPUSH', KEYS[2], unpack(records, start, math.min(start + 4999, #records)))
+    end
+    redis.call('SADD', KEYS[3], KEYS[2])
+end
+return records
+"""
+
 
 class RedisPacketHandler(PacketHandler):
     """
     Redis packet handler that implements the Observer pattern to notify changes.
     """
 
-    def __init__(self, redis_host="localhost", redis_port=6379, redis_db=0, redis_key="suricata-packets", timeout=10):
+    def __init__(self, redis_host="localhost", redis_port=6379, redis_db=0, redis_key="suricata-packets", timeout=10,
+                 chunk_size=5000, blocking=False, max_window_size=50000, field="packet",
+                 scheduler: AdaptiveScheduler = None, shedder: LoadShedder = None, reliable=False, consumer=None,
+                 max_replays=3, raw_records=False):
+        """
+        :param field: Field an eve record must carry to be processed ("packet", or "payload" for payload mode).
+        :param scheduler: Sizes the windows from the backlog and the processing time; None drains the whole list.
+        :param shedder: Sheds records of the windows above the budget of the scheduler when falling behind.
+        :param reliable: Move each window to a processing list of the consumer, removed only once the window
+            was processed, and replay the windows left there by a previous run on start. A window that fails
+            is not retried within the run: it stays in flight until the next start.
+        :param consumer: Name of the consumer owning the processing lists; must stay the same across restarts.
+            Defaults to the hostname.
+        :param max_replays: Replays of a window after which it is moved to the `<redis_key>:dead-letter` list.
+        :param raw_records: Hand the records to the observers undecoded, with `metadata["raw"]` set,
+            for observers decoding them in worker processes.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer.")
+        if max_window_size < 1:
+            raise ValueError("max_window_size must be a positive integer.")
+        if shedder is not None and scheduler is None:
+            raise ValueError("Load shedding needs an adaptive scheduler.")
+        if shedder is not None and raw_records:
+            raise ValueError("Load shedding needs decoded records.")
+
         self.redis_client = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db)
         self.redis_key = redis_key
         self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.blocking = blocking
+        self.max_window_size = max_window_size
+        self.decoder = EveDecoder(field, area="HRS", raw=raw_records)
+        self.scheduler = scheduler
+        self.shedder = shedder
+        self.reliable = reliable
+        self.consumer = consumer if consumer is not None else socket.gethostname()
+        self.inflight_key = f"{redis_key}:processing:{self.consumer}"
+        self.attempts_key = f"{self.inflight_key}:attempts"
+        self.dead_letter_key = f"{redis_key}:dead-letter"
+        self.max_replays = max_replays
+        self.batch_key = None
+        self.batch_ids = itertools.count()
+        self.move_chunk = self.redis_client.register_script(MOVE_CHUNK_SCRIPT)
         self.start_time = time.time()
         self.observers = []
-        barad_logger.debug("[HRS] RedisPacketHandler initialized with host: %s, port: %d, db: %d, key: %s, timeout: %d",
-                          redis_host, redis_port, redis_db, redis_key, timeout)
+        self.windows = metrics.counter("barad_windows", "Windows handed to the observers.", area="HRS")
+        self.ingested = metrics.counter("barad_ingested_packets", "Packet records handed to the observers.", area="HRS")
+        self.replayed = metrics.counter("barad_replayed_windows", "Windows left in flight by a previous run and replayed.", area="HRS")
+        self.unacked = metrics.counter("barad_unacknowledged_windows", "Windows left in flight after an error.", area="HRS")
+        self.dead_lettered = metrics.counter("barad_dead_letter_windows", "Windows moved to the dead-letter list after too many replays.", area="HRS")
+        barad_logger.debug("[HRS] RedisPacketHandler initialized with host: %s, port: %d, db: %d, key: %s, timeout: %d, chunk size: %d, blocking: %s, reliable: %s",
+                          redis_host, redis_port, redis_db, redis_key, timeout, chunk_size, blocking, reliable)
 
 
     def register_observer(self, observer):
@@ -59,33 +122,251 @@ class RedisPacketHandler(PacketHandler):
         return length
 
 
-    def __fetch_packets(self):
+    def __open_batch(self):
+        """
+        Names the processing list of a new window in reliable mode.
+        """
+        if self.reliable:
+            self.batch_key = f"{self.inflight_key}:{int(time.time() * 1000)}-{next(self.batch_ids)}"
+
+
+    def __ack(self, batch_key):
+        """
+        Removes a processed window from the processing lists.
+        """
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(batch_key)
+        pipe.srem(self.inflight_key, batch_key)
+        pipe.hdel(self.attempts_key, batch_key)
+        pipe.execute()
+        barad_logger.debug("[HRS] Acknowledged window %s", batch_key)
+
+
+    def __dead_letter(self, batch_key, records):
+        """
+        Moves the records of a window replayed too many times to the dead-letter list.
+        """
+        pipe = self.redis_client.pipeline(transaction=True)
+        for start in range(0, len(records), self.chunk_size):
+            pipe.rpush(self.dead_letter_key, *records[start:start + self.chunk_size])
+        pipe.delete(batch_key)
+        pipe.srem(self.inflight_key, batch_key)
+        pipe.hdel(self.attempts_key, batch_key)
+        pipe.execute()
+        self.dead_lettered.inc()
+        barad_logger.error("[HRS] Window %s failed %d replays, %d records moved to %s",
+                           batch_key, self.max_replays, len(records), self.dead_letter_key)
+
+
+    def __acknowledge(self, batch_key):
+        """
+        Returns a done callback that acknowledges the window if it was processed.
+        """
+        def callback(context: PacketContext):
+            if context.error is not None:
+                self.unacked.inc()
+                barad_logger.error("[HRS] Window %s left in flight after error: %s", batch_key, str(context.error))
+                return
+            self.__ack(batch_key)
+
+        return callback
+
+
+    def __pop_chunk(self, count):
+        """
+        Atomically reads and removes up to `count` records from the head of the Redis list.
+        In reliable mode, the records are moved to the processing list of the window.
+        """
+        if self.reliable:
+            return self.move_chunk(keys=[self.redis_key, self.batch_key, self.inflight_key], args=[count])
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.lrange(self.redis_key, 0, count - 1)
+        pipe.ltrim(self.redis_key, count, -1)
+        chunk, _ = pipe.execute()
+        return chunk
+
+
+    def __drain_chunks(self, limit=None):
+        """
+        Yields the decoded records of the Redis list chunk by chunk until it is empty,
+        or until `limit` records were drained.
+        """
+        drained = 0
+        while limit is None or drained < limit:
+            count = self.chunk_size if limit is None else min(self.chunk_size, limit - drained)
+            chunk = self.__pop_chunk(count)
+            if not chunk:
+                break
+            drained += len(chunk)
+            barad_logger.debug("[HRS] Drained chunk of %d records", len(chunk))
+            yield self.decoder.decode_many(chunk)
+            if len(chunk) < count:
+                break
+
+
+    def __fetch_packets(self, limit=None):
         """
-        Reads all packets from Redis and removes them from the list.
+        Reads packets from Redis and removes them from the list: all of them, or up to `limit` records.
         """
         packets = []
         barad_logger.debug("[HRS] Fetching packets from Redis")
-        while True:
-            packet = self.redis_client.lpop(self.redis_key)
-            if packet is None:
-                break
-            packets.append(json.loads(packet))
-        barad_logger.info("[HRS] Fetched %d packets from Redis", len(packets))
+        self.__open_batch()
+        for chunk in self.__drain_chunks(limit):
+            packets.extend(chunk)
+        barad_logger.info("[HRS] Fetched %d packets from Redis (%d other records skipped so far)",
+                          len(packets), self.decoder.rejected.value)
         return packets
-    
 
-    def __process_packets(self):
+
+    def __shed(self, packets):
+        """
+        Reduces the window to the budget of the scheduler when a shedder is set.
+        """
+        if self.shedder is None:
+            return packets
+        return self.shedder.shed(packets, self.scheduler.budget())
+
+
+    def __next_window(self, backlog):
+        """
+        Drains the records of the next adaptive window, shedding the surplus when behind.
+        """
+        limit = self.scheduler.drain_size(backlog, self.shedder is not None)
+        return self.__shed(self.__fetch_packets(limit))
+
+
+    def __tick(self):
+        """
+        Notifies the observers that `timeout` seconds passed without records, so the
+        flows waiting in a flow table can expire while the traffic is stalled.
+        """
+        context = PacketContext([], {"tick": True})
+        context.retain()
+        try:
+            self.notify_observer(context)
+        except Exception as e:
+            barad_logger.error("[HRS] Error on idle tick: %s", str(e))
+            context.release(e)
+            return
+        context.release()
+
+
+    def __collect_window(self):
+        """
+        Blocks until a record arrives, ticking the observers every `timeout` seconds
+        while idle, then collects records until the window holds
+        `max_window_size` records (or the drain size of the scheduler) or `timeout`
+        seconds have passed, whichever comes first.
+        """
+        self.__open_batch()
+        if self.reliable:
+            # Registered first: a crash before the move leaves an empty batch, not a lost record.
+            self.redis_client.sadd(self.inflight_key, self.batch_key)
+            first = self.redis_client.blmove(self.redis_key, self.batch_key, self.timeout, "LEFT", "RIGHT")
+            while first is None:
+                self.__tick()
+                first = self.redis_client.blmove(self.redis_key, self.batch_key, self.timeout, "LEFT", "RIGHT")
+        else:
+            item = self.redis_client.blpop([self.redis_key], timeout=self.timeout)
+            while item is None:
+                self.__tick()
+                item = self.redis_client.blpop([self.redis_key], timeout=self.timeout)
+            first = item[1]
+        deadline = time.time() + self.timeout
+        packets = self.decoder.decode_many([first])
+        barad_logger.debug("[HRS] Window opened")
+
+        window_size = self.max_window_size
+        if self.scheduler is not None:
+            window_size = self.scheduler.drain_size(self.__check_redis_length() + 1, self.shedder is not None)
+
+        while len(packets) < window_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            chunk = self.__pop_chunk(min(self.chunk_size, window_size - len(packets)))
+            if chunk:
+                packets.extend(self.decoder.decode_many(chunk))
+                continue
+
+            if self.reliable:
+                record = self.redis_client.blmove(self.redis_key, self.batch_key, remaining, "LEFT", "RIGHT")
+            else:
+                item = self.redis_client.blpop([self.redis_key], timeout=remaining)
+                record = item[1] if item is not None else None
+            if record is None:
+                break
+            packets.extend(self.decoder.decode_many([record]))
+
+        barad_logger.info("[HRS] Window closed with %d packets", len(packets))
+        return self.__shed(packets) if self.scheduler is not None else packets
+
+
+    def __process_packets(self, packets=None):
         """
         Processes the packets in the Redis list.
         """
 
+        packet_context = None
         try:
-            packets = self.__fetch_packets()
-            packet_context = PacketContext(packets)
+            if packets is None:
+                packets = self.__fetch_packets()
+            batch_key = self.batch_key
+            if not packets:
+                barad_logger.info("[HRS] No packet records to process")
+                if self.reliable and batch_key is not None:
+                    self.__ack(batch_key)
+                return
+            packet_context = PacketContext(packets, {"raw": True} if self.decoder.raw else {})
+            if self.reliable:
+                packet_context.add_done_callback(self.__acknowledge(batch_key))
+            if self.scheduler is not None:
+                # Observed once the last stage is done, so the pipeline queues count in the latency.
+                start_time = time.time()
+                packet_context.add_done_callback(
+                    lambda _: self.scheduler.observe(len(packets), time.time() - start_time))
+            packet_context.retain()
+            self.windows.inc()
+            self.ingested.inc(len(packets))
             self.notify_observer(packet_context)
+            packet_context.release()
 
         except Exception as e:
             barad_logger.error("[HRS] Error processing packets: %s", str(e))
+            if packet_context is not None:
+                packet_context.release(e)
+
+
+    def __replay_orphans(self):
+        """
+        Processes the windows left in flight by a previous run of this consumer, oldest first.
+        The replay is counted before processing, so a window crashing the process is counted too.
+        """
+        for batch_key in sorted(key.decode() for key in self.redis_client.smembers(self.inflight_key)):
+            records = self.redis_client.lrange(batch_key, 0, -1)
+            if self.redis_client.hincrby(self.attempts_key, batch_key, 1) > self.max_replays:
+                self.__dead_letter(batch_key, records)
+                continue
+            barad_logger.warning("[HRS] Replaying %d records of window %s left in flight", len(records), batch_key)
+            self.replayed.inc()
+            self.batch_key = batch_key
+            self.__process_packets(self.decoder.decode_many(records))
+
+
+    def __run_blocking(self):
+        """
+        Runs the packet processing pipeline on windows opened by incoming data.
+        """
+
+        barad_logger.info("[HRS] Starting event-driven packet processing")
+        if self.reliable:
+            self.__replay_orphans()
+        while True:
+            packets = self.__collect_window()
+            print(f"\x1b[34mWindow closed.\x1b[0m Found {len(packets)} packets to process.")
+            self.__process_packets(packets)
 
 
     def run(self):
@@ -93,7 +374,12 @@ class RedisPacketHandler(PacketHandler):
         Runs the packet processing pipeline.
         """
 
+        if self.blocking:
+            return self.__run_blocking()
+
         barad_logger.info("[HRS] Starting packet processing")
+        if self.reliable:
+            self.__replay_orphans()
         while True:
             elapsed_time = time.time() - self.start_time
             if elapsed_time >= self.timeout:
@@ -101,10 +387,16 @@ class RedisPacketHandler(PacketHandler):
                 if list_length > 0:
                     print(f"\x1b[34mTimeout reached.\x1b[0m Found {list_length} packets to process.")
                     barad_logger.info("[HRS] Found %d packets to process", list_length)
-                    self.__process_packets()
+                    self.__process_packets(self.__next_window(list_length) if self.scheduler is not None else None)
                 else:
                     print("No packets found. Waiting...")
                     barad_logger.info("[HRS] No packets found. Waiting...")
+                    self.__tick()
 
                 self.start_time = time.time()
+                if self.scheduler is not None and self.__check_redis_length() >= self.scheduler.budget():
+                    # Behind: a full window is already waiting, so it starts right away.
+                    barad_logger.info("[HRS] Falling behind, starting the next window now")
+                    self.start_time -= self.timeout
+                    continue
             time.sleep(1)
\ No newline at end of file
@@ -0,0 +1,277 @@
+import time
+import redis
+import socket
+
+from utils.logger import logging
+from utils.monitoring import metrics
+from utils.handlers.packet_handler import PacketContext
+from utils.handlers.packet_handler import PacketHandler
+from utils.handlers.eve_decoder import EveDecoder
+
+barad_logger = logging.getLogger("barad_logger")
+
+
+class RedisStreamPacketHandler(PacketHandler):
+    """
+    Redis Stream packet handler that reads through a consumer group, so several
+    workers can share the same stream. Entries are acknowledged once the observers
+    are done with them, and entries left pending by dead workers are reclaimed;
+    entries reclaimed more than `max_replays` times go to the `<redis_key>:dead-letter` stream.
+    """
+
+    def __init__(self, redis_host="localhost", redis_port=6379, redis_db=0, redis_key="suricata-packets",
+                 group="barad-dur", consumer=None, timeout=10, chunk_size=5000, max_window_size=50000,
+                 min_idle_time=60000, field="eve", event_field="packet", max_replays=3,
+                 raw_records=False):
+        """
+        :param field: Field of the stream entries holding the eve record.
+        :param event_field: Field an eve record must carry to be processed ("packet", or "payload" for payload mode).
+        :param max_replays: Reclaims of an entry after which it is moved to the dead-letter stream and acknowledged.
+        :param raw_records: Hand the eve records to the observers undecoded, with `metadata["raw"]` set,
+            for observers decoding them in worker processes.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer.")
+        if max_window_size < 1:
+            raise ValueError("max_window_size must be a positive integer.")
+
+        self.redis_client = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db)
+        self.redis_key = redis_key
+        self.group = group
+        self.consumer = consumer if consumer is not None else socket.gethostname()
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.max_window_size = max_window_size
+        self.min_idle_time = min_idle_time
+        self.max_replays = max_replays
+        self.dead_letter_key = f"{redis_key}:dead-letter"
+        self.field = field.encode()
+        self.decoder = EveDecoder(event_field, area="HSS", raw=raw_records)
+        self.observers = []
+        self.windows = metrics.counter("barad_windows", "Windows handed to the observers.", area="HSS")
+        self.ingested = metrics.counter("barad_ingested_packets", "Packet records handed to the observers.", area="HSS")
+        self.dead_lettered = metrics.counter("barad_dead_letter_entries", "Entries moved to the dead-letter stream after too many replays.", area="HSS")
+        self.__create_group()
+        barad_logger.debug("[HSS] RedisStreamPacketHandler initialized with host: %s, port: %d, db: %d, key: %s, group: %s, consumer: %s",
+                          redis_host, redis_port, redis_db, redis_key, group, self.consumer)
+
+
+    def register_observer(self, observer):
+        """
+        Registers an observer for notification.
+        """
+        barad_logger.debug("[HSS] Observer registered: %s", observer)
+        self.observers.append(observer)
+
+
+    def remove_observer(self, observer):
+        """
+        Removes an observer from the list.
+        """
+        barad_logger.debug("[HSS] Observer removed: %s", observer)
+        self.observers.remove(observer)
+
+
+    def notify_observer(self, context):
+        """
+        Notifies all registered observers.
+        """
+        barad_logger.debug("[HSS] Notifying observers with context: %s", context)
+        for observer in self.observers:
+            barad_logger.debug("[HSS] Observer %s notified", observer)
+            observer.update(context)
+
+
+    def __create_group(self):
+        """
+        Creates the consumer group, and the stream if needed, unless it already exists.
+        """
+        try:
+            self.redis_client.xgroup_create(self.redis_key, self.group, id="0", mkstream=True)
+            barad_logger.info("[HSS] Consumer group %s created on %s", self.group, self.redis_key)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+
+    def __decode_entries(self, entries, ids, packets):
+        """
+        Appends the ids and the decoded eve records of the stream entries.
+        """
+        for entry_id, fields in entries:
+            ids.append(entry_id)
+            if not fields or self.field not in fields:
+                continue
+            event = self.decoder.decode(fields[self.field])
+            if event is not None:
+                packets.append(event)
+
+
+    def __dead_letter(self, entries):
+        """
+        Moves the claimed entries delivered more than `max_replays` + 1 times to the dead-letter
+        stream, acknowledging them, and returns the other entries.
+        """
+        if not entries:
+            return entries
+
+        # One exact-id query per entry: a range query truncated to len(entries) could return
+        # other pending ids of the range and miss some of the claimed ones.
+        pipe = self.redis_client.pipeline(transaction=False)
+        for entry_id, _ in entries:
+            pipe.xpending_range(self.redis_key, self.group, min=entry_id, max=entry_id, count=1)
+        deliveries = {entry["message_id"]: entry["times_delivered"] for pending in pipe.execute() for entry in pending}
+        poisoned = [(entry_id, fields) for entry_id, fields in entries
+                    if deliveries.get(entry_id, 0) > self.max_replays + 1]
+        if not poisoned:
+            return entries
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        for entry_id, fields in poisoned:
+            pipe.xadd(self.dead_letter_key, dict(fields or {}, stream_id=entry_id))
+            pipe.xack(self.redis_key, self.group, entry_id)
+        pipe.execute()
+        self.dead_lettered.inc(len(poisoned))
+        barad_logger.error("[HSS] %d entries failed %d replays, moved to %s", len(poisoned), self.max_replays, self.dead_letter_key)
+
+        dead = {entry_id for entry_id, _ in poisoned}
+        return [(entry_id, fields) for entry_id, fields in entries if entry_id not in dead]
+
+
+    def __reclaim_pending(self, ids, packets):
+        """
+        Claims the entries left pending by other consumers for longer than `min_idle_time`.
+        """
+        start_id = "0-0"
+        while len(ids) < self.max_window_size:
+            count = min(self.chunk_size, self.max_window_size - len(ids))
+            reply = self.redis_client.xautoclaim(self.redis_key, self.group, self.consumer,
+                                                 self.min_idle_time, start_id=start_id, count=count)
+            start_id, entries = reply[0], self.__dead_letter(reply[1])
+            self.__decode_entries(entries, ids, packets)
+            if start_id in (b"0-0", "0-0"):
+                break
+
+        if ids:
+            barad_logger.info("[HSS] Reclaimed %d pending entries", len(ids))
+
+
+    def __read_chunk(self, count, block=None):
+        """
+        Reads up to `count` new entries for this consumer, blocking for `block` milliseconds if given.
+        """
+        reply = self.redis_client.xreadgroup(self.group, self.consumer, {self.redis_key: ">"},
+                                             count=count, block=block)
+        if not reply:
+            return []
+        return reply[0][1]
+
+
+    def __collect_window(self):
+        """
+        Collects a window of entries: pending entries of dead consumers first, otherwise
+        new entries until `max_window_size` entries are read or `timeout` seconds have passed.
+        """
+        ids, packets = [], []
+        self.__reclaim_pending(ids, packets)
+        if ids:
+            return ids, packets
+
+        self.__decode_entries(self.__read_chunk(self.chunk_size, block=int(self.timeout * 1000)), ids, packets)
+        if not ids:
+            return ids, packets
+
+        deadline = time.time() + self.timeout
+        while len(ids) < self.max_window_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            entries = self.__read_chunk(min(self.chunk_size, self.max_window_size - len(ids)),
+                                        block=max(1, int(remaining * 1000)))
+            if not entries:
+                break
+            self.__decode_entries(entries, ids, packets)
+
+        return ids, packets
+
+
+    def __ack(self, ids):
+        """
+        Acknowledges the entries in chunks of `chunk_size` ids.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for start in range(0, len(ids), self.chunk_size):
+            pipe.xack(self.redis_key, self.group, *ids[start:start + self.chunk_size])
+        pipe.execute()
+        barad_logger.debug("[HSS] Acknowledged %d entries", len(ids))
+
+
+    def __acknowledge(self, ids):
+        """
+        Returns a done callback that acknowledges the entries if the window was processed.
+        """
+        def callback(context: PacketContext):
+            if context.error is not None:
+                barad_logger.error("[HSS] %d entries left pending after error: %s", len(ids), str(context.error))
+                return
+            self.__ack(ids)
+
+        return callback
+
+
+    def __tick(self):
+        """
+        Notifies the observers that `timeout` seconds passed without entries, so the
+        flows waiting in a flow table can expire while the traffic is stalled.
+        """
+        context = PacketContext([], {"tick": True})
+        context.retain()
+        try:
+            self.notify_observer(context)
+        except Exception as e:
+            barad_logger.error("[HSS] Error on idle tick: %s", str(e))
+            context.release(e)
+            return
+        context.release()
+
+
+    def __process_packets(self, ids, packets):
+        """
+        Processes a window of stream entries and acknowledges them once processed.
+        """
+        packet_context = PacketContext(packets, {"stream_ids": ids, "raw": self.decoder.raw})
+        packet_context.add_done_callback(self.__acknowledge(ids))
+        packet_context.retain()
+        self.windows.inc()
+        self.ingested.inc(len(packets))
+
+        try:
+            self.notify_observer(packet_context)
+            packet_context.release()
+
+        except Exception as e:
+            barad_logger.error("[HSS] Error processing packets: %s", str(e))
+            packet_context.release(e)
+
+
+    def run(self):
+        """
+        Runs the packet processing pipeline.
+        """
+
+        barad_logger.info("[HSS] Starting packet processing as consumer %s of group %s", self.consumer, self.group)
+        while True:
+            ids, packets = self.__collect_window()
+            if not ids:
+                barad_logger.info("[HSS] No packets found. Waiting...")
+                self.__tick()
+                continue
+            if not packets:
+                barad_logger.info("[HSS] No packet records in %d entries", len(ids))
+                self.__ack(ids)
+                continue
+
+            print(f"\x1b[34mWindow closed.\x1b[0m Found {len(packets)} packets to process.")
+            barad_logger.info("[HSS] Found %d packets to process", len(packets))
+            self.__process_packets(ids, packets)
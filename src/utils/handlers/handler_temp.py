@@ -1,14 +1,168 @@
 import os
+import queue
+import atexit
+import shutil
+import logging
+import itertools
+import threading
 
-TEMP_DIR = "./.temp/"
+barad_logger = logging.getLogger("barad_logger")
+
+SHM_DIR = "/dev/shm"
+# /dev/shm is often capped at 64 MB in containers, too small for a window of packets.
+MIN_SHM_FREE = 256 * 1024 ** 2
+
+
+def select_temp_dir() -> str:
+    """
+    Returns the directory of the temporary files: $BARAD_TEMP_DIR if set, else a
+    directory of this process on /dev/shm when it is RAM-backed and large enough,
+    else ./.temp/.
+    """
+    configured = os.environ.get("BARAD_TEMP_DIR")
+    if configured:
+        return os.path.join(configured, "")
+
+    try:
+        if os.access(SHM_DIR, os.W_OK) and shutil.disk_usage(SHM_DIR).free >= MIN_SHM_FREE:
+            return os.path.join(SHM_DIR, f"barad-{os.getpid()}", "")
+    except OSError:
+        pass
+    return "./.temp/"
+
+
+TEMP_DIR = select_temp_dir()
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def sweep_stale_temp_dirs():
+    """
+    Removes the /dev/shm directories left behind by processes that died without cleaning up.
+    """
+    try:
+        names = os.listdir(SHM_DIR)
+    except OSError:
+        return
+    for name in names:
+        pid = name[len("barad-"):]
+        if not name.startswith("barad-") or not pid.isdigit() or _process_alive(int(pid)):
+            continue
+        barad_logger.info("[TMP] Removing the staging directory of dead process %s", pid)
+        shutil.rmtree(os.path.join(SHM_DIR, name), ignore_errors=True)
 
 def setup_temp_dir():
+    if TEMP_DIR.startswith(os.path.join(SHM_DIR, "")):
+        sweep_stale_temp_dirs()
     os.makedirs(TEMP_DIR, exist_ok=True)
 
 def cleanup_temp_dir():
-    for file in os.listdir(TEMP_DIR):
-        os.remove(TEMP_DIR + file)
-    os.rmdir(TEMP_DIR)
+    shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+def _remove_empty_temp_dir(pid=os.getpid()):
+    # The directory is per process on /dev/shm: do not leave it behind when nothing was staged.
+    if os.getpid() == pid:
+        try:
+            os.rmdir(TEMP_DIR)
+        except OSError:
+            pass
+
+
+class StagedWindow:
+    """
+    Temporary files of one window, named after the window so windows can overlap.
+    """
+
+    def __init__(self, area, name: str):
+        self.area = area
+        self.name = name
+        self.paths = []
+        self.discarded = False
+
+    def path(self, filename: str) -> str:
+        """
+        Returns the path of a temporary file of the window, removed when the window is discarded.
+        """
+        path = os.path.join(self.area.directory, f"{self.name}-{filename}")
+        self.paths.append(path)
+        return path
+
+    def discard(self):
+        """
+        Schedules the removal of the files of the window; later calls do nothing.
+        """
+        if not self.discarded:
+            self.discarded = True
+            self.area.discard(self.paths)
+
+
+class StagingArea:
+    """
+    Hands out per-window temporary files and removes them from a background thread,
+    so the pipeline does not wait on the unlink of large pcap and CSV files.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory if directory is not None else TEMP_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self.counter = itertools.count()
+        self.pending = queue.Queue()
+        self.cleaner = None
+        self._lock = threading.Lock()
+        barad_logger.debug("[TMP] Staging temporary files in %s", self.directory)
+
+    def window(self) -> StagedWindow:
+        """
+        Returns the staging of a new window.
+        """
+        return StagedWindow(self, f"window-{os.getpid()}-{next(self.counter)}")
+
+    def discard(self, paths: list):
+        """
+        Queues files for removal.
+        """
+        if self.cleaner is None:
+            with self._lock:
+                if self.cleaner is None:
+                    self.cleaner = threading.Thread(target=self._clean_loop, name="barad-staging", daemon=True)
+                    self.cleaner.start()
+        self.pending.put(list(paths))
+
+    def _remove(self, paths: list):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                barad_logger.warning("[TMP] Failed to remove %s: %s", path, str(e))
+
+    def _clean_loop(self):
+        while True:
+            paths = self.pending.get()
+            if paths is None:
+                return
+            self._remove(paths)
+
+    def close(self):
+        """
+        Removes the files still queued and stops the cleaner.
+        """
+        if self.cleaner is not None:
+            self.pending.put(None)
+            self.cleaner.join()
+            self.cleaner = None
+        while not self.pending.empty():
+            paths = self.pending.get_nowait()
+            if paths is not None:
+                self._remove(paths)
 
 
-setup_temp_dir()
\ No newline at end of file
+setup_temp_dir()
+atexit.register(_remove_empty_temp_dir)
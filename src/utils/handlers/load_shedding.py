@@ -0,0 +1,126 @@
+import logging
+
+from utils.monitoring import metrics
+from utils.flowmeter import flow_hash
+
+barad_logger = logging.getLogger("barad_logger")
+
+SHED_POLICIES = ("protocol", "sample")
+
+
+class AdaptiveScheduler:
+    """
+    Sizes the windows of a handler so each one is processed within a target latency.
+
+    The processing cost per packet is an exponential moving average of the end-to-end
+    latency of the last windows, measured when their context is released by the last stage;
+    the window budget is the number of packets that cost allows within the target latency,
+    capped to [min, max] window size.
+    Until a window was measured, the budget is the minimum window size.
+    """
+
+    def __init__(self, target_latency: float, min_window_size: int = 1000, max_window_size: int = 50000,
+                 smoothing: float = 0.3, drain_factor: int = 4, area: str = "HRS"):
+        """
+        :param target_latency: Seconds a window may take from its collection to the end of its processing.
+        :param smoothing: Weight of the last window in the moving average of the cost per packet.
+        :param drain_factor: While behind, up to drain_factor times the budget is drained per window and shed.
+        """
+        if target_latency <= 0:
+            raise ValueError("target_latency must be positive.")
+        if not 1 <= min_window_size <= max_window_size:
+            raise ValueError("min_window_size must be positive and not above max_window_size.")
+
+        self.target_latency = target_latency
+        self.min_window_size = min_window_size
+        self.max_window_size = max_window_size
+        self.smoothing = smoothing
+        self.drain_factor = drain_factor
+        self.seconds_per_packet = None
+        self.backlog_gauge = metrics.gauge("barad_backlog_records", "Records waiting in Redis after a window was drained.", area=area)
+        self.budget_gauge = metrics.gauge("barad_window_budget", "Packets the next window may hold.", area=area)
+        self.latency = metrics.histogram("barad_window_seconds", "Time from the collection of a window to the end of its processing.", area=area)
+
+    def observe(self, packets: int, seconds: float):
+        """
+        Records the time a window of `packets` packets took from its collection to the end of its processing.
+        """
+        self.latency.observe(seconds)
+        if packets == 0:
+            return
+        cost = seconds / packets
+        if self.seconds_per_packet is None:
+            self.seconds_per_packet = cost
+        else:
+            self.seconds_per_packet += self.smoothing * (cost - self.seconds_per_packet)
+
+    def budget(self) -> int:
+        """
+        Returns the number of packets the next window may hold.
+        """
+        if self.seconds_per_packet is None:
+            budget = self.min_window_size
+        elif self.seconds_per_packet == 0:
+            budget = self.max_window_size
+        else:
+            budget = int(self.target_latency / self.seconds_per_packet)
+        budget = max(self.min_window_size, min(self.max_window_size, budget))
+        self.budget_gauge.set(budget)
+        return budget
+
+    def drain_size(self, backlog: int, shedding: bool) -> int:
+        """
+        Returns how many records to drain for the next window: the budget, or more
+        when behind and the surplus can be shed.
+        """
+        self.backlog_gauge.set(backlog)
+        budget = self.budget()
+        if shedding and backlog > budget:
+            return min(backlog, budget * self.drain_factor)
+        return budget
+
+
+class LoadShedder:
+    """
+    Reduces a window towards its budget by applying the shedding policies in order, until it fits:
+
+    - "protocol": drops the records of the low-priority protocols;
+    - "sample": keeps a share of the flows, chosen by flow hash so a flow is kept or shed whole.
+
+    No policy bounds the kept records: "sample" keeps the expected share of the flows, but
+    whole flows of any size, so a window may stay above its budget, bounded by the records
+    drained for it.
+    """
+
+    def __init__(self, policies: list, protocols=("ICMP", "IPV6-ICMP"), area: str = "HRS"):
+        unknown = [policy for policy in policies if policy not in SHED_POLICIES]
+        if unknown:
+            raise ValueError(f"Unknown shedding policies: {unknown}, expected {SHED_POLICIES}.")
+
+        self.policies = list(policies)
+        self.area = area
+        self.protocols = {protocol.upper() for protocol in protocols}
+        self.shed_counters = {policy: metrics.counter("barad_shed_records", "Records shed while falling behind.",
+                                                      area=area, policy=policy)
+                              for policy in self.policies}
+
+    def _apply(self, policy: str, packets: list, budget: int) -> list:
+        if policy == "protocol":
+            return [packet for packet in packets if str(packet.get("proto", "")).upper() not in self.protocols]
+
+        # Flow hashes are uniform over 32 bits: keeping those below a threshold keeps a share of the flows.
+        threshold = int(budget / len(packets) * 2 ** 32)
+        return [packet for packet in packets if flow_hash(packet) < threshold]
+
+    def shed(self, packets: list, budget: int) -> list:
+        """
+        Returns the packets of the window that are kept.
+        """
+        for policy in self.policies:
+            if len(packets) <= budget:
+                break
+            before = len(packets)
+            packets = self._apply(policy, packets, budget)
+            self.shed_counters[policy].inc(before - len(packets))
+            barad_logger.warning("[%s] Shed %d records with the %s policy", self.area, before - len(packets), policy)
+        return packets
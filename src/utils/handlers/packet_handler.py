@@ -1,7 +1,42 @@
+import threading
+
+
 class PacketContext:
     def __init__(self, packets, metadata: dict = None):
         self.packets = packets
         self.metadata = metadata if metadata is not None else {}
+        self.error = None
+        self._pending = 0
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def add_done_callback(self, callback):
+        """
+        Registers a callback called with the context once every stage released it.
+        """
+        self._callbacks.append(callback)
+
+    def retain(self):
+        """
+        Marks the context as still being processed by one more stage.
+        """
+        with self._lock:
+            self._pending += 1
+
+    def release(self, error: Exception = None):
+        """
+        Marks one stage as done with the context, recording its error if any.
+        """
+        with self._lock:
+            if error is not None and self.error is None:
+                self.error = error
+            self._pending -= 1
+            if self._pending > 0:
+                return
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback(self)
 
 class PacketHandler:
     def register_observer(self, observer):
@@ -0,0 +1,76 @@
+import mmap
+import struct
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+
+
+class PcapReadError(Exception):
+    pass
+
+
+class PcapReader:
+    """
+    Reads a pcap file through a memory map, chunk by chunk, without copying the file.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise PcapReadError(f"The file '{file_path}' is empty.")
+
+        magic = self._map[:4]
+        if magic == PCAPNG_MAGIC:
+            self.close()
+            raise PcapReadError("pcapng files are not supported, convert them with `editcap -F pcap`.")
+        if magic not in PCAP_MAGIC:
+            self.close()
+            raise PcapReadError(f"The file '{file_path}' is not a pcap file.")
+
+        endianness, self.resolution = PCAP_MAGIC[magic]
+        self._header = struct.Struct(endianness + "IIII")
+        _, _, _, _, self.snaplen, self.linktype = struct.unpack_from(endianness + "HHiIII", self._map, 4)
+        self._offset = 24
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def chunks(self, chunk_size: int):
+        """
+        Yields lists of at most `chunk_size` (timestamp, frame) pairs.
+        """
+        header = self._header
+        data = self._map
+        end = len(data)
+        chunk = []
+
+        while self._offset + header.size <= end:
+            ts_sec, ts_frac, caplen, _ = header.unpack_from(data, self._offset)
+            start = self._offset + header.size
+            if start + caplen > end:
+                break
+            chunk.append((ts_sec + ts_frac * self.resolution, data[start:start + caplen]))
+            self._offset = start + caplen
+
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
@@ -1 +1,3 @@
-from .model import ModelHandler
\ No newline at end of file
+from .model import ModelHandler
+from .preprocessing import Preprocessor
+from .cache import PredictionCache
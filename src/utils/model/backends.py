@@ -0,0 +1,158 @@
+import os
+import logging
+import numpy as np
+
+barad_logger = logging.getLogger("barad_logger")
+
+
+class BackendError(Exception):
+    pass
+
+
+class InferenceBackend:
+    """
+    Runs a model on float32 feature matrices. TensorFlow is only imported by the Keras backend.
+    """
+    filename = None
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.input_shape = ()
+        self.output_shape = None
+
+    def _run(self, features: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def warm_up(self):
+        """
+        Run the model once so the first window does not pay for the initialization.
+        """
+        output = self._run(np.zeros((1,) + self.input_shape, dtype=np.float32))
+        self.output_shape = tuple(output.shape[1:])
+        barad_logger.debug("[MDL] %s warmed up for input shape %s", type(self).__name__, self.input_shape)
+
+    def predict(self, features: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+        """
+        Run the model on the features, batch by batch.
+        """
+        features = np.ascontiguousarray(features, dtype=np.float32).reshape((-1,) + self.input_shape)
+        if len(features) == 0:
+            if self.output_shape is None:
+                self.warm_up()
+            return np.empty((0,) + self.output_shape, dtype=np.float32)
+        return np.concatenate([self._run(features[start:start + batch_size])
+                               for start in range(0, len(features), batch_size)])
+
+
+class KerasBackend(InferenceBackend):
+    """
+    Runs `model.keras` through a tf.function traced once with a fixed input signature.
+    """
+    filename = "model.keras"
+
+    def __init__(self, model_path: str):
+        super().__init__(model_path)
+        import tensorflow as tf
+
+        self.model = tf.keras.models.load_model(os.path.join(model_path, self.filename))
+        self.input_shape = tuple(self.model.inputs[0].shape[1:])
+
+        @tf.function(input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.float32)])
+        def infer(features):
+            return self.model(features, training=False)
+
+        self._infer = infer
+
+    def _run(self, features: np.ndarray) -> np.ndarray:
+        return self._infer(features).numpy()
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    Runs `model.onnx` with ONNX Runtime on the CPU.
+    """
+    filename = "model.onnx"
+
+    def __init__(self, model_path: str):
+        super().__init__(model_path)
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(os.path.join(model_path, self.filename), options,
+                                                    providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = tuple(model_input.shape[1:])
+
+    def _run(self, features: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: features})[0]
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    Runs `model.tflite` with the standalone TFLite runtime, or with TensorFlow if it is the only one installed.
+    The model has a fixed batch size: the last batch of a window is zero-padded.
+    """
+    filename = "model.tflite"
+
+    def __init__(self, model_path: str):
+        super().__init__(model_path)
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=os.path.join(model_path, self.filename))
+        self.interpreter.allocate_tensors()
+        model_input = self.interpreter.get_input_details()[0]
+        self.input_index = model_input["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.input_shape = tuple(int(size) for size in model_input["shape"][1:])
+        self.batch_size = int(model_input["shape"][0])
+
+    def _run(self, features: np.ndarray) -> np.ndarray:
+        rows = len(features)
+        if rows < self.batch_size:
+            features = np.concatenate([features, np.zeros((self.batch_size - rows,) + self.input_shape, dtype=np.float32)])
+
+        self.interpreter.set_tensor(self.input_index, features)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)[:rows]
+
+    def predict(self, features: np.ndarray, batch_size: int = None) -> np.ndarray:
+        return super().predict(features, self.batch_size)
+
+
+BACKENDS = {
+    "onnx": OnnxBackend,
+    "tflite": TFLiteBackend,
+    "keras": KerasBackend,
+}
+
+
+def load_backend(model_path: str, backend: str = "auto") -> InferenceBackend:
+    """
+    Load the inference backend of a model. With "auto", the first lightweight model file
+    found (ONNX, then TFLite) whose runtime is installed is used, otherwise `model.keras`.
+    """
+    if backend != "auto":
+        if backend not in BACKENDS:
+            raise BackendError(f"Unknown inference backend: {backend}")
+        barad_logger.info("[MDL] Loading %s backend", backend)
+        return BACKENDS[backend](model_path)
+
+    for name, backend_class in BACKENDS.items():
+        if not os.path.exists(os.path.join(model_path, backend_class.filename)):
+            continue
+        try:
+            barad_logger.info("[MDL] Loading %s backend", name)
+            return backend_class(model_path)
+        except ImportError as e:
+            barad_logger.warning("[MDL] %s backend unavailable: %s", name, str(e))
+
+    raise BackendError(f"No loadable model found in '{model_path}'.")
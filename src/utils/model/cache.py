@@ -0,0 +1,80 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from utils.monitoring import metrics
+
+
+class PredictionCache:
+    """
+    LRU cache of the model outputs, keyed by the model input rounded to `decimals`.
+
+    Keepalives, health checks and scans produce the same feature vectors window after
+    window: only the vectors missing from the cache are sent to the model, once per window.
+    Entries expire `ttl` seconds after they were computed.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 300, decimals: int = 4):
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer.")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = metrics.counter("barad_prediction_cache_hits", "Rows predicted without running the model.")
+        self.misses = metrics.counter("barad_prediction_cache_misses", "Rows sent to the model.")
+        self.hit_ratio = metrics.gauge("barad_prediction_cache_hit_ratio", "Share of the rows predicted without running the model since start.")
+        self.size = metrics.gauge("barad_prediction_cache_entries", "Predictions held in the cache.")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self, features: np.ndarray) -> list:
+        """
+        Returns the cache key of each row: the bytes of the rounded float32 row.
+        """
+        # Adding 0.0 turns -0.0 into 0.0, so both round to the same key.
+        rounded = np.ascontiguousarray(np.round(features, self.decimals), dtype=np.float32) + np.float32(0.0)
+        return [row.tobytes() for row in rounded.reshape(len(rounded), -1)]
+
+    def predict(self, features: np.ndarray, predict) -> np.ndarray:
+        """
+        Returns the model outputs of the rows, calling `predict` on the rows missing from the cache only.
+        """
+        if len(features) == 0:
+            return predict(features)
+
+        now = time.time()
+        keys = self.keys(features)
+        outputs = [None] * len(keys)
+        missing = {}
+        with self._lock:
+            for index, key in enumerate(keys):
+                entry = self.entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self.entries.move_to_end(key)
+                    outputs[index] = entry[0]
+                else:
+                    missing.setdefault(key, []).append(index)
+
+        if missing:
+            computed = predict(features[[indexes[0] for indexes in missing.values()]])
+            with self._lock:
+                for (key, indexes), output in zip(missing.items(), computed):
+                    self.entries[key] = (output.copy(), now + self.ttl)
+                    self.entries.move_to_end(key)
+                    for index in indexes:
+                        outputs[index] = output
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+
+        # Rows repeating a missing vector of the same window did not reach the model either.
+        self.hits.inc(len(keys) - len(missing))
+        self.misses.inc(len(missing))
+        total = self.hits.value + self.misses.value
+        self.hit_ratio.set(self.hits.value / total if total else 0.0)
+        self.size.set(len(self.entries))
+        return np.stack(outputs)
@@ -3,31 +3,50 @@ import json
 import logging
 import numpy as np
 import pandas as pd
-import tensorflow as tf
 
-from utils.monitoring import monitor_context
+from utils.monitoring import monitor_decorator
+from .preprocessing import Preprocessor
+from .cache import PredictionCache
+from .backends import InferenceBackend, load_backend
 from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
 
+try:
+    import pyarrow
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
 barad_logger = logging.getLogger("barad_logger")
 
+# Columns of the NTLFlowLyzer CSV identifying the flow of each row.
+IDENTITY_COLUMNS = ("flow_id", "timestamp", "src_ip", "src_port", "dst_ip", "dst_port", "protocol")
+
 
 class ModelHandler:
     """
     Model handler class that loads a pre-trained model and metadata to make predictions.
     """
 
-    def __init__(self, model, selected_features: list, mapping: list):
+    def __init__(self, model: InferenceBackend, selected_features: list, mapping: list, preprocessor: Preprocessor = None,
+                 version: str = None, cache: PredictionCache = None):
         self.model = model
+        self.version = version
+        self.cache = cache
         self.selected_features = selected_features
         self.mapping = mapping
+        self.labels = np.asarray(mapping if isinstance(mapping, list) else [mapping[str(i)] for i in range(len(mapping))])
+        self.preprocessor = preprocessor
+
+        if preprocessor is not None and preprocessor.selected_features != list(selected_features):
+            raise ValueError("The pre-processing artifact does not match the selected features.")
 
 
     @staticmethod
-    def load_model_and_metadata(model_path: str):
+    def load_model_and_metadata(model_path: str, backend: str = "auto", cache: PredictionCache = None):
         """
         Load the pre-trained model and metadata from the specified path.
         """
-        model = tf.keras.models.load_model(os.path.join(model_path, "model.keras"))
+        model = load_backend(model_path, backend)
 
         with open(os.path.join(model_path, "features.json"), "r") as f:
             selected_features = json.load(f)
@@ -35,15 +54,89 @@ class ModelHandler:
         with open(os.path.join(model_path, "mapping.json"), "r") as f:
             mapping = json.load(f)
 
-        return ModelHandler(model, selected_features, mapping)
+        preprocessor = Preprocessor.load(model_path)
+        if preprocessor is None and cache is not None:
+            # Inputs scaled on the min/max of their own window are never the same twice.
+            raise ValueError("The prediction cache requires the pre-processing artifact of the model.")
+        if preprocessor is None:
+            barad_logger.warning("[MDL] No pre-processing artifact found, scaling and encoding will be fitted on every window.")
+
+        model.warm_up()
+        version = os.path.basename(os.path.normpath(model_path))
+        return ModelHandler(model, selected_features, mapping, preprocessor, version, cache)
+
+
+    def _to_label_indexes(self, predictions: np.ndarray) -> np.ndarray:
+        """
+        Convert the model outputs into indexes of the mapping list: argmax over the classes,
+        or a 0.5 threshold for a single sigmoid output.
+        """
+        if predictions.ndim == 2 and predictions.shape[1] > 1:
+            indexes = predictions.argmax(axis=1)
+        else:
+            indexes = (predictions.reshape(-1) >= 0.5).astype(np.int64)
+
+        if indexes.size and (indexes.max() >= len(self.labels) or indexes.min() < 0):
+            raise ValueError("The predicted values are out of range for the mapping list.")
+        return indexes
+
+
+    def scores(self, predictions: np.ndarray) -> np.ndarray:
+        """
+        Return the model confidence in the predicted label of each row.
+        """
+        indexes = self._to_label_indexes(predictions)
+        if predictions.ndim == 2 and predictions.shape[1] > 1:
+            return predictions[np.arange(len(indexes)), indexes]
+        predictions = predictions.reshape(-1)
+        return np.where(indexes == 1, predictions, 1 - predictions)
+
+
+    def _csv_columns(self, header):
+        """
+        Return the numeric and the categorical columns of the CSV header needed by the model.
+        """
+        if self.preprocessor is not None:
+            categorical = {column for _, column, _ in self.preprocessor.encoded}
+            needed = set(self.preprocessor.required_columns)
+        else:
+            categorical = {column for column in header
+                           if any(feature.startswith(column + "_") for feature in self.selected_features)}
+            needed = set(self.selected_features) | categorical
+
+        numeric = [column for column in header if column in needed and column not in categorical]
+        return numeric, [column for column in header if column in categorical]
 
 
     def _read_csv(self, file):
         """
-        Read the CSV file and return a Pandas DataFrame.
+        Read the columns needed by the model from the CSV file and return a Pandas DataFrame.
         """
 
-        return pd.read_csv(file)
+        header = pd.read_csv(file, nrows=0).columns
+        numeric, categorical = self._csv_columns(header)
+
+        identity = [column for column in IDENTITY_COLUMNS if column in header and column not in numeric + categorical]
+
+        dtype = {column: np.float32 for column in numeric}
+        dtype.update({column: str for column in categorical})
+        engine = "pyarrow" if has_pyarrow else "c"
+
+        data = pd.read_csv(file, usecols=numeric + categorical + identity, dtype=dtype, engine=engine)
+        barad_logger.debug("[MDL] Read %d rows and %d of %d columns with the %s engine",
+                           len(data), len(data.columns), len(header), engine)
+        return data
+
+
+    def _split_identities(self, data: pd.DataFrame):
+        """
+        Separate the identity columns that are not model features from the data.
+        """
+        identity = [column for column in IDENTITY_COLUMNS if column in data.columns]
+        only_identity = [column for column in identity if column not in self.selected_features
+                         and (self.preprocessor is None or column not in self.preprocessor.required_columns)
+                         and not any(feature.startswith(column + "_") for feature in self.selected_features)]
+        return data.drop(columns=only_identity), data[identity]
 
 
     def _clean_data(self, data: pd.DataFrame):
@@ -55,7 +148,7 @@ class ModelHandler:
         data.replace([np.inf, -np.inf], np.nan, inplace=True)
         data.drop_duplicates(inplace=True)
 
-        float_cols = data.select_dtypes(include=['float64']).columns
+        float_cols = data.select_dtypes(include=['floating']).columns
         data[float_cols] = data[float_cols].round(4)
 
         barad_logger.info("[MDL] Data cleaning complete.")
@@ -119,30 +212,89 @@ class ModelHandler:
 
         self.__check_data(data)
         features_data = data[self.selected_features].to_numpy()
+        return self._predict_array(features_data)
+
+
+    def _predict_array(self, features_data: np.ndarray):
+        """
+        Make predictions on a matrix holding the selected features in order.
+        """
 
         barad_logger.info("[MDL] Starting prediction")
         print("Starting prediction...")
 
-        predictions = self.model.predict(features_data)
+        if self.cache is not None:
+            predictions = self.cache.predict(np.asarray(features_data, dtype=np.float32), self.model.predict)
+        else:
+            predictions = self.model.predict(features_data)
+        labels = self.labels[self._to_label_indexes(predictions)]
 
-        for i, value_pred in enumerate(predictions):
-            if value_pred >= len(self.mapping) or value_pred < 0:
-                raise ValueError(f"The predicted value {value_pred} is out of range for the mapping list.")
-
-            output_pred = self.mapping[int(value_pred)]
-            if output_pred != "Benign":
-                print(f"\x1b[31m\x1b[1m[MDL] Alert: Potential attack detected in record {i + 1}\x1b[0m")
-                barad_logger.warning(f"\x1b[31m\x1b[1m[MDL] Alert: Potential attack detected in record {i + 1}\x1b[0m")
+        attacks = np.count_nonzero(labels != "Benign")
+        if attacks:
+            print(f"\x1b[31m\x1b[1m[MDL] Alert: Potential attack detected in {attacks} of {len(labels)} records\x1b[0m")
+            barad_logger.warning(f"\x1b[31m\x1b[1m[MDL] Alert: Potential attack detected in {attacks} of {len(labels)} records\x1b[0m")
 
         barad_logger.info("[MDL] Prediction complete.")
         print("Prediction complete.")
+        return labels, predictions
+
+
+    def _normalize_features(self, features: np.ndarray):
+        """
+        Min-max normalize each column of the feature matrix, as MinMaxScaler does.
+        """
+        barad_logger.info("[MDL] Normalizing features...")
+
+        minimum = np.nanmin(features, axis=0)
+        data_range = np.nanmax(features, axis=0) - minimum
+        data_range[data_range == 0] = 1
+        features = (features - minimum) / data_range
 
+        barad_logger.info("[MDL] Feature normalization complete.")
+        return features
 
+
+    @monitor_decorator(code_area="MDL")
     def run(self, file):
+        """
+        Run the model on the flows of a NTLFlowLyzer CSV file.
+
+        :return: Labels, model outputs and identity columns (list of dicts) of the rows kept.
+        """
         barad_logger.info("[MDL] Pre-processing from packet data...")
-        data = self._read_csv(file)
-        data = self._clean_data(data)
+        # Duplicates are dropped with the identity columns, so distinct flows with the same features are all kept.
+        data, identities = self._split_identities(self._clean_data(self._read_csv(file)))
+        identities = identities.to_dict("records")
+
+        if self.preprocessor is not None:
+            features = self.preprocessor.transform(self.preprocessor.select(data))
+            barad_logger.info("[MDL] Pre-processing complete.")
+            return self._predict_array(features) + (identities,)
+
         data = self.__one_hot_encode(data)
         data = self.__normalize_data(data)
         barad_logger.info("[MDL] Pre-processing complete.")
-        self.predict(data)
\ No newline at end of file
+        return self.predict(data) + (identities,)
+
+
+    @monitor_decorator(code_area="MDL")
+    def run_features(self, features: np.ndarray):
+        """
+        Run the model on a feature matrix computed by the FlowFeatureExtractor.
+
+        :return: Labels and model outputs of the rows.
+        """
+        if features.shape[1] != len(self.selected_features):
+            raise ValueError(f"Expected {len(self.selected_features)} features, got {features.shape[1]}.")
+        if features.shape[0] == 0:
+            barad_logger.info("[MDL] No flows to predict.")
+            return self.labels[:0], np.empty((0, 1), dtype=np.float32)
+
+        barad_logger.info("[MDL] Pre-processing from extracted features...")
+        features = np.where(np.isinf(features), np.nan, features).round(4)
+        if self.preprocessor is not None:
+            features = self.preprocessor.transform(features)
+        else:
+            features = self._normalize_features(features)
+        barad_logger.info("[MDL] Pre-processing complete.")
+        return self._predict_array(features)
@@ -0,0 +1,119 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+barad_logger = logging.getLogger("barad_logger")
+
+PREPROCESSING_FILENAME = "preprocessing.json"
+
+
+class Preprocessor:
+    """
+    Frozen pre-processing of the selected features: one-hot encoding with fixed
+    category vocabularies and min-max scaling with the training min/max vectors.
+
+    It is stored as `preprocessing.json` next to `model.keras` and `features.json`:
+
+        {
+            "features": ["duration", ..., "activity_Benign-Systemic"],
+            "min": [0.0, ...],
+            "max": [120.5, ...],
+            "categories": {"activity": ["Benign-Systemic", ...]}
+        }
+    """
+
+    def __init__(self, selected_features: list, minimum, maximum, categories: dict = None):
+        self.selected_features = list(selected_features)
+        self.minimum = np.asarray(minimum, dtype=np.float32)
+        self.maximum = np.asarray(maximum, dtype=np.float32)
+        self.categories = categories if categories is not None else {}
+
+        if self.minimum.shape != (len(self.selected_features),) or self.maximum.shape != self.minimum.shape:
+            raise ValueError("min and max must have one value per selected feature.")
+
+        data_range = self.maximum - self.minimum
+        data_range[data_range == 0] = 1
+        self.scale = 1 / data_range
+
+        # Selected features produced by the one-hot encoding, as (index, column, category).
+        self.encoded = []
+        for i, feature in enumerate(self.selected_features):
+            for column, values in self.categories.items():
+                prefix = column + "_"
+                if feature.startswith(prefix) and feature[len(prefix):] in values:
+                    self.encoded.append((i, column, feature[len(prefix):]))
+                    break
+
+        encoded_indexes = {i for i, _, _ in self.encoded}
+        self.numeric = [(i, feature) for i, feature in enumerate(self.selected_features) if i not in encoded_indexes]
+        self.required_columns = [feature for _, feature in self.numeric] + sorted({column for _, column, _ in self.encoded})
+
+
+    @staticmethod
+    def load(model_path: str):
+        """
+        Load the pre-processing artifact of a model, or return None if the model has none.
+        """
+        path = os.path.join(model_path, PREPROCESSING_FILENAME)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r") as f:
+            artifact = json.load(f)
+
+        return Preprocessor(artifact["features"], artifact["min"], artifact["max"], artifact.get("categories"))
+
+
+    def save(self, model_path: str):
+        """
+        Save the pre-processing artifact next to the model.
+        """
+        artifact = {
+            "features": self.selected_features,
+            "min": self.minimum.tolist(),
+            "max": self.maximum.tolist(),
+            "categories": self.categories,
+        }
+        with open(os.path.join(model_path, PREPROCESSING_FILENAME), "w") as f:
+            json.dump(artifact, f, indent=4)
+
+
+    @staticmethod
+    def fit(data: pd.DataFrame, selected_features: list):
+        """
+        Build the artifact from the training data, before one-hot encoding and normalization.
+        """
+        object_cols = [column for column in data.select_dtypes(include=['object']).columns
+                       if any(feature.startswith(column + "_") for feature in selected_features)]
+        categories = {column: sorted(data[column].dropna().astype(str).unique().tolist()) for column in object_cols}
+        preprocessor = Preprocessor(selected_features, np.zeros(len(selected_features)),
+                                    np.ones(len(selected_features)), categories)
+
+        features = preprocessor.select(data)
+        return Preprocessor(selected_features, np.nanmin(features, axis=0), np.nanmax(features, axis=0), categories)
+
+
+    def select(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        Build the (rows x selected features) float32 matrix from the raw columns, one-hot encoding
+        the categorical ones.
+        """
+        missing = [column for column in self.required_columns if column not in data.columns]
+        if missing:
+            raise ValueError(f"The following features are missing in the DataFrame: {missing}")
+
+        features = np.empty((len(data), len(self.selected_features)), dtype=np.float32)
+        for i, column in self.numeric:
+            features[:, i] = data[column].to_numpy(dtype=np.float32)
+        for i, column, category in self.encoded:
+            features[:, i] = (data[column].astype(str) == category).to_numpy(dtype=np.float32)
+        return features
+
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        """
+        Scale a (rows x selected features) matrix with the training min/max vectors.
+        """
+        return (features - self.minimum) * self.scale
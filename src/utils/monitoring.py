@@ -2,85 +2,354 @@ import os
 import time
 import json
 import redis
+import atexit
+import bisect
 import psutil
 import logging
-from contextlib import contextmanager 
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 barad_logger = logging.getLogger("barad_logger")
 
-class Monitoring:
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    """
+    Monotonic counter.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name + "_total", labels, self.value)]
+
+
+class Gauge:
+    """
+    Value that can go up and down.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        samples, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append((name + "_bucket", labels + (("le", le),), cumulative))
+        samples.append((name + "_sum", labels, total))
+        samples.append((name + "_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
     """
-    Monitoring class for system monitoring.
-    Analyze latency, throughput, CPU and RAM usage.
+    Process-wide registry of counters, gauges and histograms, aggregated in memory.
+
+    Monitoring records are queued and pushed to Redis in batches by a background
+    thread, and the metrics can be scraped in the Prometheus text format.
     """
 
-    def __init__(self, pid=None, host="localhost", port=6379, db=1, database_name="monitoring"):
-        self.pid = pid if pid is not None else os.getpid()
-        self.process = psutil.Process(self.pid)
-        self.process.cpu_percent(None)
-        self.num_cores = psutil.cpu_count(logical=True)
+    TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+    def __init__(self, host="localhost", port=6379, db=1, database_name="monitoring", interval=5.0, max_pending=100000):
+        self.families = {}
+        self.remote = {}
+        self.autoflush = True
+        self._lock = threading.Lock()
+        self.configure(host, port, db, database_name, interval, max_pending)
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def configure(self, host="localhost", port=6379, db=1, database_name="monitoring", interval=5.0, max_pending=100000):
+        """
+        Sets where and how often the monitoring records are flushed.
+        """
+        if getattr(self, "_stop", None) is not None:
+            self._stop.set()
+        self.host, self.port, self.db = host, port, db
         self.dataset_name = database_name
-        self.logging_db = redis.StrictRedis(host=host, port=port, db=db)
+        self.interval = interval
+        self.pending = deque(maxlen=max_pending)
+        self._client = None
+        self._flusher = None
+        self._stop = threading.Event()
+        self._process = None
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self):
+        # The flusher thread and the Redis connection are not inherited by a forked child.
+        self._lock = threading.Lock()
+        self.pending.clear()
+        self._client = None
+        self._flusher = None
+        self._stop = threading.Event()
+        self._process = None
+        self._pid = os.getpid()
 
-    def get_cpu_usage(self, interval=None):
+    def reset(self):
         """
-        Get the CPU usage of the process.
+        Drops every metric and queued record, e.g. in a worker reporting to a parent process.
         """
-        raw_cpu_usage = self.process.cpu_percent(interval=interval)
-        normalized_cpu_usage = raw_cpu_usage / self.num_cores if self.num_cores else raw_cpu_usage
-        return normalized_cpu_usage
-    
-    def get_ram_usage(self):
+        with self._lock:
+            self.families = {}
+            self.remote = {}
+        self.pending.clear()
+
+    def _get(self, kind, name, description, labels, *args):
+        key = tuple(sorted(labels.items()))
+        family = self.families.get(name)
+        if family is not None and key in family[2]:
+            return family[2][key]
+
+        with self._lock:
+            family = self.families.setdefault(name, (kind, description, {}))
+            if family[0] is not kind:
+                raise ValueError(f"Metric {name} is already registered as a {self.TYPES[family[0]]}.")
+            return family[2].setdefault(key, kind(*args))
+
+    def counter(self, name, description="", **labels) -> Counter:
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name, description="", **labels) -> Gauge:
+        return self._get(Gauge, name, description, labels)
+
+    def histogram(self, name, description="", buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._get(Histogram, name, description, labels, buckets)
+
+    def ram_usage(self):
         """
-        Get the RAM usage of the process.
+        Returns the RSS of the process in MB.
         """
-        return self.process.memory_info().rss / (1024 ** 2)
-    
-    def save_to_db(self, code_area, elapsed_time, cpu_usage, ram_usage):
+        if self._process is None:
+            self._process = psutil.Process(self._pid)
+        return self._process.memory_info().rss / (1024 ** 2)
+
+    def record(self, code_area, elapsed_time, cpu_usage, ram_usage):
         """
-        Save a monitoring status to the database.
+        Aggregates a monitoring status and queues it for the database.
         """
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        data = {
-            "timestamp": timestamp,
+        self.histogram("barad_duration_seconds", "Duration of the monitored code areas.", area=code_area).observe(elapsed_time)
+        self.gauge("barad_cpu_usage_percent", "CPU usage of the last call, normalized by the cores.", area=code_area).set(cpu_usage)
+        self.gauge("barad_ram_usage_megabytes", "RSS of the process after the last call.", area=code_area).set(ram_usage)
+
+        self.pending.append({
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
             "elapsed_time": elapsed_time,
             "cpu_usage": cpu_usage,
             "ram_usage": ram_usage,
             "code_area": code_area
+        })
+        if self._flusher is None and self.autoflush:
+            self._start_flusher()
+
+    def drain(self) -> list:
+        """
+        Removes and returns the queued monitoring records.
+        """
+        records = []
+        while self.pending:
+            try:
+                records.append(self.pending.popleft())
+            except IndexError:
+                break
+        return records
+
+    def extend(self, records: list):
+        """
+        Queues monitoring records drained from another registry.
+        """
+        self.pending.extend(records)
+        if self._flusher is None and self.autoflush and records:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, args=(self._stop,), name="barad-metrics", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self, stop):
+        while not stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Pushes the queued monitoring records to the database in one pipeline.
+        """
+        batch = [json.dumps(record) for record in self.drain()]
+        if not batch:
+            return
+
+        try:
+            if self._client is None:
+                self._client = redis.StrictRedis(host=self.host, port=self.port, db=self.db)
+            pipe = self._client.pipeline(transaction=False)
+            for start in range(0, len(batch), 1000):
+                pipe.rpush(self.dataset_name, *batch[start:start + 1000])
+            pipe.execute()
+            barad_logger.debug(f"[MS] Saved {len(batch)} records to list '{self.dataset_name}'")
+        except redis.exceptions.RedisError as e:
+            barad_logger.warning(f"[MS] Failed to save {len(batch)} monitoring records: {str(e)}")
+            self.pending.extendleft(json.loads(record) for record in reversed(batch))
+
+    def close(self):
+        """
+        Stops the flusher and pushes the remaining records.
+        """
+        self._stop.set()
+        self.flush()
+
+    def snapshot(self) -> dict:
+        """
+        Returns the type, description and samples of every metric, by name.
+        """
+        with self._lock:
+            families = list(self.families.items())
+        return {
+            name: (self.TYPES[kind], description,
+                   [sample for labels, metric in sorted(metrics.items()) for sample in metric.samples(name, labels)])
+            for name, (kind, description, metrics) in families
         }
-        self.logging_db.rpush(self.dataset_name, json.dumps(data))
-        barad_logger.debug(f"Saved record to list '{self.dataset_name}': {data}")
 
+    def merge(self, source: str, snapshot: dict):
+        """
+        Keeps the latest snapshot of another registry; its samples are rendered with a `source` label.
+        """
+        self.remote[source] = snapshot
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        families = {}
+        for name, (kind, description, samples) in self.snapshot().items():
+            families[name] = (kind, description, list(samples))
+        for source, snapshot in sorted(self.remote.items()):
+            for name, (kind, description, samples) in snapshot.items():
+                family = families.setdefault(name, (kind, description, []))
+                family[2].extend((sample_name, (("source", source),) + sample_labels, value)
+                                 for sample_name, sample_labels, value in samples)
+
+        lines = []
+        for name, (kind, description, samples) in sorted(families.items()):
+            if description:
+                lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, sample_labels, value in samples:
+                label_text = ",".join(f'{key}="{label}"' for key, label in sample_labels)
+                lines.append(f"{sample_name}{{{label_text}}} {value}" if label_text else f"{sample_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves the metrics on http://host:port/metrics from a background thread.
+        """
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
 
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        threading.Thread(target=server.serve_forever, name="barad-metrics-http", daemon=True).start()
+        barad_logger.info(f"[MS] Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+
+metrics = MetricsRegistry()
+atexit.register(metrics.close)
 
-    
 # -----------------------------------------------------------
 
+class _Measure:
+    """
+    Measures the elapsed time and the CPU usage of a block of code.
+    """
+
+    num_cores = os.cpu_count() or 1
+
+    def __init__(self, code_area):
+        self.code_area = code_area
+        self.start_time = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def stop(self):
+        elapsed_time = time.perf_counter() - self.start_time
+        cpu_time = time.process_time() - self.start_cpu
+        cpu_usage = 100 * cpu_time / elapsed_time / self.num_cores if elapsed_time > 0 else 0.0
+        ram_usage = metrics.ram_usage()
+
+        code_area_ = f"-{self.code_area}" if self.code_area else ""
+        barad_logger.info(f"[MS{code_area_}] Elapsed time: {elapsed_time:.2f} seconds")
+        barad_logger.info(f"[MS{code_area_}] CPU usage: {cpu_usage:.2f}%")
+        barad_logger.info(f"[MS{code_area_}] RAM usage: {ram_usage:.2f} MB")
+
+        metrics.record(self.code_area, elapsed_time, cpu_usage, ram_usage)
+
+
 def monitor_decorator(code_area:str="", interval:float=None):
     """
-    Decorator to monitor the CPU and RAM usage of a function.
+    Decorator to monitor the elapsed time, CPU and RAM usage of a function.
+    `interval` is kept for compatibility, the CPU usage is measured over the call.
     """
     def decorator(func):
         def wrapper(*args, **kwargs):
-            code_area_ = f"-{code_area}" if isinstance(code_area, str) else ""
-
-            monitor = Monitoring()
-            monitor.get_cpu_usage(interval=interval)
-            start_time = time.time()
-            
-            result = func(*args, **kwargs)
-            
-            elapsed_time = time.time() - start_time
-            cpu_usage = monitor.get_cpu_usage(interval=interval)
-            ram_usage = monitor.get_ram_usage()
-            
-            barad_logger.info(f"[MS{code_area_}] Elapsed time: {elapsed_time:.2f} seconds")
-            barad_logger.info(f"[MS{code_area_}] CPU usage: {cpu_usage:.2f}%")
-            barad_logger.info(f"[MS{code_area_}] RAM usage: {ram_usage:.2f} MB")
-
-            monitor.save_to_db(code_area, elapsed_time, cpu_usage, ram_usage)
-            
-            return result
+            measure = _Measure(code_area)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                measure.stop()
         return wrapper
     return decorator
 
@@ -89,24 +358,10 @@ def monitor_decorator(code_area:str="", interval:float=None):
 @contextmanager
 def monitor_context(code_area="", interval=None):
     """
-    Context manager to monitor the CPU and RAM usage of a block of code.
+    Context manager to monitor the elapsed time, CPU and RAM usage of a block of code.
     """
-
-    code_area_ = f"-{code_area}" if isinstance(code_area, str) else ""
-
-    monitor = Monitoring()
-    monitor.get_cpu_usage(interval=interval)
-    start_time = time.time()
-    
+    measure = _Measure(code_area)
     try:
-        yield monitor
+        yield metrics
     finally:
-        elapsed_time = time.time() - start_time
-        cpu_usage = monitor.get_cpu_usage(interval=interval)
-        ram_usage = monitor.get_ram_usage()
-        
-        barad_logger.info(f"[MS{code_area_}] Elapsed time: {elapsed_time:.2f} seconds")
-        barad_logger.info(f"[MS{code_area_}] CPU usage: {cpu_usage:.2f}%")
-        barad_logger.info(f"[MS{code_area_}] RAM usage: {ram_usage:.2f} MB")
-
-        monitor.save_to_db(code_area, elapsed_time, cpu_usage, ram_usage)
\ No newline at end of file
+        measure.stop()
@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
 from utils.eve2pcap import PcapConverter
 from utils.pcap2csv import CsvConverter
-from utils.model import ModelHandler
+from utils.model import ModelHandler, PredictionCache
+from utils.flowmeter import FlowFeatureExtractor, FlowTable
 from utils.handlers.packet_handler import PacketContext
-from utils.handlers.handler_temp import TEMP_DIR
+from utils.handlers.handler_temp import TEMP_DIR, StagingArea
+from utils.alerts import AlertSink, AlertAggregator, flow_identity, csv_identity
 
 
 class Observer(ABC):
@@ -11,26 +13,121 @@ class Observer(ABC):
     def update(self, packets):
         pass
 
+    def close(self):
+        """
+        Releases the resources of the observer on shutdown.
+        """
+        pass
+
+
+class StagingObserver(Observer):
+    """
+    Gives each window its own temporary files, removed once the window is done.
+    """
+    def __init__(self, staging: StagingArea):
+        self.staging = staging
+
+    def update(self, context: PacketContext):
+        if context.metadata.get("flush") or context.metadata.get("tick"):
+            return
+        window = self.staging.window()
+        context.metadata["staging"] = window
+        # Windows failing before the model are discarded when their context is released.
+        context.add_done_callback(lambda _: window.discard())
+
 
 class PcapConverterObserver(Observer):
-    def __init__(self, output_filename, dlt=None, payload=False):
+    def __init__(self, output_filename=None, dlt=None, payload=False):
         self.pcap_converter = PcapConverter(output_filename, dlt, payload)
 
     def update(self, context: PacketContext):
+        if context.metadata.get("flush") or context.metadata.get("tick"):
+            return
+        staging = context.metadata.get("staging")
+        if staging is not None and self.pcap_converter.output_filename is None:
+            context.metadata["pcap_file"] = staging.path("output.pcap")
+            try:
+                self.pcap_converter.run(context.packets, context.metadata["pcap_file"])
+            except Exception:
+                staging.discard()
+                raise
+            return
         self.pcap_converter.run(context.packets)
+        if self.pcap_converter.output is not None:
+            context.metadata["pcap"] = self.pcap_converter.output
 
 
 class CsvConverterObserver(Observer):
-    def __init__(self, config_ntl, online_capturing: bool = False, batch_mode: bool = False, continuous_mode: bool = False):
-        self.csv_converter = CsvConverter(config_ntl, online_capturing, batch_mode, continuous_mode)
+    def __init__(self, config_ntl, online_capturing: bool = False, batch_mode: bool = False, continuous_mode: bool = False,
+                 workers: int = 1, ordered: bool = False, on_result=None):
+        self.csv_converter = CsvConverter(config_ntl, online_capturing, batch_mode, continuous_mode, workers, ordered, on_result)
 
     def update(self, context: PacketContext = None):
+        if context is not None and (context.metadata.get("flush") or context.metadata.get("tick")):
+            return
+        if context is not None and "pcap_file" in context.metadata:
+            staging = context.metadata["staging"]
+            context.metadata["csv_file"] = staging.path("output.csv")
+            try:
+                self.csv_converter.run(context.metadata["pcap_file"], context.metadata["csv_file"])
+            except Exception:
+                staging.discard()
+                raise
+            return
         self.csv_converter.run()
 
 
+class FlowFeatureObserver(Observer):
+    def __init__(self, selected_features: list, flow_table: FlowTable = None, emit_updates: bool = False):
+        self.extractor = FlowFeatureExtractor(selected_features, flow_table, emit_updates)
+
+    def update(self, context: PacketContext):
+        if context.metadata.get("flush"):
+            features, flows = self.extractor.flush()
+        elif context.metadata.get("tick"):
+            features, flows = self.extractor.expire()
+        else:
+            features, flows = self.extractor.run(context.packets, context.metadata.get("linktype"))
+        context.metadata["features"] = features
+        context.metadata["flows"] = flows
+
+
 class ModelHandlerObserver(Observer):
-    def __init__(self, model_path: str):
-        self.model_handler = ModelHandler.load_model_and_metadata(model_path)
+    def __init__(self, model_path: str, backend: str = "auto", alert_sink: AlertSink = None,
+                 dedup_ttl: float = 300, summary_threshold: int = 100, cache_size: int = 0, cache_ttl: float = 300):
+        cache = PredictionCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.model_handler = ModelHandler.load_model_and_metadata(model_path, backend, cache)
+        self.alerts = None
+        if alert_sink is not None:
+            self.alerts = AlertAggregator(alert_sink, self.model_handler.version, dedup_ttl, summary_threshold)
+
+    def close(self):
+        if self.alerts is not None:
+            self.alerts.close()
+
+    def _report(self, rows, labels, predictions, identity_of):
+        if self.alerts is not None and len(labels):
+            self.alerts.add(rows, labels, self.model_handler.scores(predictions), identity_of)
+
+    def run_file(self, file: str):
+        labels, predictions, identities = self.model_handler.run(file)
+        self._report(identities, labels, predictions, csv_identity)
+        return labels, predictions
 
     def update(self, context: PacketContext = None):
-        self.model_handler.run(TEMP_DIR + "output.csv")
\ No newline at end of file
+        if context is not None and "features" in context.metadata:
+            labels, predictions = self.model_handler.run_features(context.metadata["features"])
+            self._report(context.metadata["flows"], labels, predictions, flow_identity)
+        elif context is not None and (context.metadata.get("flush") or context.metadata.get("tick")):
+            return
+        elif context is not None and "csv_file" in context.metadata:
+            try:
+                labels, predictions = self.run_file(context.metadata["csv_file"])
+            finally:
+                context.metadata["staging"].discard()
+        else:
+            labels, predictions = self.run_file(TEMP_DIR + "output.csv")
+
+        if context is not None:
+            context.metadata["labels"] = labels
+            context.metadata["predictions"] = predictions
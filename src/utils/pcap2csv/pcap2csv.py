@@ -1,7 +1,9 @@
 import io
+import os
 import glob
 import logging
 from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from NTLFlowLyzer.network_flow_analyzer import NTLFlowLyzer
 
 from utils.monitoring import monitor_decorator
@@ -18,45 +20,134 @@ def find_pcap_files(directory):
     pcap_files = glob.glob(file_pattern)
     return pcap_files
 
+
+# Configuration loaded once per batch worker process.
+_worker_config = None
+_worker_modes = None
+
+def _init_worker(config_dict: dict, online_capturig: bool, continues_batch_mode: bool):
+    global _worker_config, _worker_modes
+    _worker_config = ConfigLoaderFromDict(config_dict)
+    _worker_modes = (online_capturig, continues_batch_mode)
+
+def _convert_file(file: str) -> str:
+    """
+    Converts one pcap file of the batch with the configuration of the worker.
+    """
+    output_file_name = file.split('/')[-1]
+    _worker_config.pcap_file_address = file
+    _worker_config.output_file_address = f"{_worker_config.batch_address_output}/{output_file_name}.csv"
+
+    # NTLFlowLyzer binds the input file when it is built, so only the configuration is reused.
+    network_flow_analyzer = NTLFlowLyzer(_worker_config, *_worker_modes)
+    with io.StringIO() as f, redirect_stdout(f):  # Sopprime le stampe durante la conversione
+        network_flow_analyzer.run()
+
+    return _worker_config.output_file_address
+
+
 class CsvConverter:
-    def __init__(self, config_dict: dict, online_capturig: bool=False, batch_mode: bool=False, continues_batch_mode: bool=False):
+    def __init__(self, config_dict: dict, online_capturig: bool=False, batch_mode: bool=False, continues_batch_mode: bool=False,
+                 workers: int=1, ordered: bool=False, on_result=None):
+        """
+        :param workers: Number of processes converting the batch files in parallel.
+        :param ordered: If True, batch results are collected in file order, otherwise as soon as they are ready.
+        :param on_result: Called with the path of each CSV file of the batch once it is written;
+            the file is removed when it returns, so a large batch does not pile up in the temporary directory.
+        """
+        if workers < 1:
+            raise ValueError("workers must be a positive integer.")
+
         self.config_dict = config_dict
         self.online_capturig = online_capturig
         self.batch_mode = batch_mode
         self.continues_batch_mode = continues_batch_mode
+        self.workers = workers
+        self.ordered = ordered
+        self.on_result = on_result
+        self.failures = {}
+
+    def _collect(self, file: str, output_file: str, outputs: list):
+        barad_logger.info(f"[P2C] Converted {file} to {output_file}")
+        outputs.append(output_file)
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(output_file)
+        except Exception as e:
+            barad_logger.error(f"[P2C] Failed to process {output_file}: {str(e)}")
+            self.failures[file] = str(e)
+        finally:
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+
+    def _run_batch(self, pcap_files: list) -> list:
+        """
+        Converts the batch files, isolating the failure of each file.
+        """
+        outputs = []
+        self.failures = {}
+        initargs = (self.config_dict, self.online_capturig, self.continues_batch_mode)
+
+        if self.workers == 1:
+            _init_worker(*initargs)
+            for file in pcap_files:
+                try:
+                    output_file = _convert_file(file)
+                except Exception as e:
+                    barad_logger.error(f"[P2C] Failed to convert {file}: {str(e)}")
+                    self.failures[file] = str(e)
+                    continue
+                self._collect(file, output_file, outputs)
+            return outputs
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=initargs) as pool:
+            futures = {pool.submit(_convert_file, file): file for file in pcap_files}
+            for future in (futures if self.ordered else as_completed(futures)):
+                file = futures[future]
+                try:
+                    output_file = future.result()
+                except Exception as e:
+                    barad_logger.error(f"[P2C] Failed to convert {file}: {str(e)}")
+                    self.failures[file] = str(e)
+                    continue
+                self._collect(file, output_file, outputs)
+
+        return outputs
 
     @monitor_decorator(code_area="P2C")
-    def run(self):
+    def run(self, pcap_file: str = None, output_file: str = None):
+        """
+        :param pcap_file: Pcap file converted by this call, instead of the one of the configuration.
+        :param output_file: CSV file written by this call, instead of the one of the configuration.
+        """
         try:
-            config = ConfigLoaderFromDict(self.config_dict)
-            network_flow_analyzer = NTLFlowLyzer(config, self.online_capturig, self.continues_batch_mode)
+            config_dict = dict(self.config_dict)
+            if pcap_file is not None:
+                config_dict["pcap_file_address"] = pcap_file
+            if output_file is not None:
+                config_dict["output_file_address"] = output_file
+            config = ConfigLoaderFromDict(config_dict)
 
             if not self.batch_mode:
+                network_flow_analyzer = NTLFlowLyzer(config, self.online_capturig, self.continues_batch_mode)
                 with io.StringIO() as f, redirect_stdout(f):  # Sopprime tutte le stampe
                     network_flow_analyzer.run()
                 return
 
             barad_logger.info("[P2C] Batch mode is on!")
-            batch_address = config.batch_address
-            batch_address_output = config.batch_address_output
-            pcap_files = find_pcap_files(batch_address)
-            barad_logger.info(f"[P2C] {len(pcap_files)} files detected.")
+            pcap_files = find_pcap_files(config.batch_address)
+            barad_logger.info(f"[P2C] {len(pcap_files)} files detected, converting with {self.workers} workers.")
 
             print(f"{len(pcap_files)} files detected. Let's analyze them!")
-            for file in pcap_files:
-                barad_logger.info(100 * "#")
-                output_file_name = file.split('/')[-1]
-                config.pcap_file_address = file
-                config.output_file_address = f"{batch_address_output}/{output_file_name}.csv"
-                network_flow_analyzer = NTLFlowLyzer(config, self.online_capturig, self.continues_batch_mode)
-
-                barad_logger.info(f"[P2C] Converting {file} to {config.output_file_address}")
-                barad_logger.info("[P2C] Nexts are the logs from NTLFlowLyzer:")
-                print("NTLFlowLyzer is running...")
-
-                with io.StringIO() as f, redirect_stdout(f):  # Sopprime le stampe durante la conversione
-                    network_flow_analyzer.run()
+            print("NTLFlowLyzer is running...")
+            outputs = self._run_batch(pcap_files)
+            print("NTLFlowLyzer is done.")
 
-                print("NTLFlowLyzer is done.")
+            if self.failures:
+                barad_logger.warning(f"[P2C] {len(self.failures)} of {len(pcap_files)} files failed.")
+            return outputs
         except Exception as e:
             raise CSVConversionError(f"[P2C] An error occurred: {str(e)}")
@@ -0,0 +1,129 @@
+import time
+import queue
+import logging
+import threading
+
+from utils.observer import Observer
+from utils.monitoring import metrics
+from utils.handlers.packet_handler import PacketContext
+
+barad_logger = logging.getLogger("barad_logger")
+
+_STOP = object()
+
+
+class PipelineStage(threading.Thread):
+    """
+    Thread running a group of observers on the contexts of its input queue, then
+    handing each context to the next stage.
+    """
+
+    def __init__(self, name: str, observers: list, queue_size: int):
+        super().__init__(name=f"barad-{name}", daemon=True)
+        self.stage_name = name
+        self.observers = observers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next_stage = None
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.depth_gauge = metrics.gauge("barad_queue_depth", "Windows waiting in front of a pipeline stage.", stage=name)
+        self.failure_counter = metrics.counter("barad_stage_failures", "Windows a pipeline stage failed to process.", stage=name)
+
+    def put(self, context):
+        """
+        Queues a context, blocking while the stage is full.
+        """
+        self.queue.put(context)
+        self.depth_gauge.set(self.queue.qsize())
+
+    def run(self):
+        while True:
+            context = self.queue.get()
+            self.depth_gauge.set(self.queue.qsize())
+            if context is _STOP:
+                if self.next_stage is not None:
+                    self.next_stage.put(_STOP)
+                return
+
+            start_time = time.time()
+            try:
+                for observer in self.observers:
+                    observer.update(context)
+            except Exception as e:
+                self.failed += 1
+                self.failure_counter.inc()
+                barad_logger.error("[PPL] Stage %s failed: %s", self.stage_name, str(e))
+                context.release(e)
+                continue
+            finally:
+                self.busy_time += time.time() - start_time
+
+            self.processed += 1
+            if self.next_stage is not None:
+                self.next_stage.put(context)
+            else:
+                context.release()
+
+
+class PipelineObserver(Observer):
+    """
+    Observer running groups of observers as concurrent stages connected by bounded
+    queues. The handler is blocked while the first stage is full, which leaves the
+    backlog in Redis instead of in memory.
+    """
+
+    def __init__(self, stages: dict, queue_size: int = 2):
+        """
+        :param stages: Observers of each stage by stage name, in pipeline order.
+        :param queue_size: Maximum number of windows waiting in front of each stage.
+        """
+        if not stages:
+            raise ValueError("The pipeline needs at least one stage.")
+        if queue_size < 1:
+            raise ValueError("queue_size must be a positive integer.")
+
+        self.stages = [PipelineStage(name, observers, queue_size) for name, observers in stages.items()]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        barad_logger.debug("[PPL] Pipeline initialized with stages: %s", [stage.stage_name for stage in self.stages])
+
+    def start(self):
+        """
+        Starts the stage threads.
+        """
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Lets the stages finish the queued windows, then stops them.
+        """
+        self.stages[0].put(_STOP)
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def update(self, context: PacketContext):
+        context.retain()
+        self.stages[0].put(context)
+        barad_logger.debug("[PPL] Queue depths: %s", self.queue_depths())
+
+    def queue_depths(self) -> dict:
+        """
+        Returns the number of windows waiting in front of each stage.
+        """
+        return {stage.stage_name: stage.queue.qsize() for stage in self.stages}
+
+    def stats(self) -> dict:
+        """
+        Returns the queue depth, processed and failed windows and busy seconds of each stage.
+        """
+        return {
+            stage.stage_name: {
+                "queue_depth": stage.queue.qsize(),
+                "processed": stage.processed,
+                "failed": stage.failed,
+                "busy_time": stage.busy_time,
+            }
+            for stage in self.stages
+        }
@@ -0,0 +1,212 @@
+import queue
+import logging
+import threading
+import multiprocessing
+
+from utils.observer import Observer
+from utils.monitoring import metrics
+from utils.flowmeter import flow_hash
+from utils.handlers.eve_decoder import EveDecoder
+from utils.handlers.packet_handler import PacketContext
+
+barad_logger = logging.getLogger("barad_logger")
+
+
+def shard_of(event, shards: int, linktype: int = None) -> int:
+    """
+    Returns the shard of a packet, the same for every packet of its flow.
+    """
+    return flow_hash(event, linktype) % shards
+
+
+def _shard_main(index: int, factory, field: str, inbox, outbox):
+    """
+    Loop of a shard process: decodes the raw records of each window, runs the observers
+    built by `factory` on it and sends back its error and the metrics of the shard.
+    """
+    metrics.reset()
+    metrics.autoflush = False
+    decoder = EveDecoder(field, area="SHD")
+    observers = factory()
+
+    try:
+        while True:
+            window = inbox.get()
+            if window is None:
+                return
+
+            seq, packets, metadata = window
+            if metadata.get("raw"):
+                packets = decoder.decode_many(packets)
+            context = PacketContext(packets, metadata)
+            error = None
+            try:
+                for observer in observers:
+                    observer.update(context)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            outbox.put((seq, index, error, metrics.drain(), metrics.snapshot()))
+    finally:
+        for observer in observers:
+            observer.close()
+
+
+class ShardedObserver(Observer):
+    """
+    Spreads the decoding, the native feature extraction and the inference of each window
+    over worker processes.
+
+    Records are routed by a stable hash of their flow (the flow_id found in the raw bytes of
+    eve records, the raw header bytes of frames) without decoding them, so a flow never splits
+    across workers and each worker keeps its own flow table, model and alert sink. The
+    supervisor only routes the windows and merges the metrics of the workers: it moves on to
+    the next window right away, and a window is released once every worker processed its part,
+    with at most `max_pending` windows in flight.
+    """
+
+    def __init__(self, factory, shards: int, field: str = "packet", max_pending: int = 2, reply_timeout: float = 1.0):
+        """
+        :param factory: Called in each worker to build its observers, in order.
+        :param shards: Number of worker processes.
+        :param field: Field the raw eve records carry ("packet", or "payload" for payload mode).
+        :param max_pending: Windows in flight before `update` blocks, which leaves the backlog upstream.
+        :param reply_timeout: Seconds between two checks that the workers are still alive.
+        """
+        if shards < 1:
+            raise ValueError("shards must be a positive integer.")
+        if max_pending < 1:
+            raise ValueError("max_pending must be a positive integer.")
+
+        self.factory = factory
+        self.shards = shards
+        self.field = field
+        self.reply_timeout = reply_timeout
+        self.processes = []
+        self.inboxes = []
+        self.outbox = None
+        self.collector = None
+        self.seq = 0
+        # Windows in flight by sequence number: their context and the shards that did not reply yet.
+        self.pending = {}
+        self.dead = set()
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.routed = [metrics.counter("barad_shard_packets", "Packets routed to a shard.", shard=str(index))
+                       for index in range(shards)]
+
+    def start(self):
+        """
+        Forks the worker processes and starts collecting their replies.
+        """
+        mp = multiprocessing.get_context("fork")
+        self.outbox = mp.Queue()
+        for index in range(self.shards):
+            inbox = mp.Queue()
+            process = mp.Process(target=_shard_main, args=(index, self.factory, self.field, inbox, self.outbox),
+                                 name=f"barad-shard-{index}", daemon=True)
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        self.collector = threading.Thread(target=self._collect, name="barad-shards", daemon=True)
+        self.collector.start()
+        barad_logger.info("[SHD] Started %d shards", self.shards)
+
+    def stop(self, timeout: float = None):
+        """
+        Waits for the windows in flight, then stops the workers.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending, timeout)
+            self.stopping = True
+        if self.collector is not None:
+            self.collector.join(timeout)
+        for inbox, process in zip(self.inboxes, self.processes):
+            if process.is_alive():
+                inbox.put(None)
+        for process in self.processes:
+            process.join(timeout)
+        self.processes, self.inboxes, self.collector = [], [], None
+
+    def route(self, packets: list, linktype: int = None) -> list:
+        """
+        Splits the packets of a window by shard.
+        """
+        parts = [[] for _ in range(self.shards)]
+        for packet in packets:
+            parts[shard_of(packet, self.shards, linktype)].append(packet)
+        for counter, part in zip(self.routed, parts):
+            counter.inc(len(part))
+        return parts
+
+    def _complete(self, seq: int, error: Exception = None):
+        with self.condition:
+            context, _, errors = self.pending.pop(seq)
+            self.condition.notify_all()
+        self.slots.release()
+        if error is None and errors:
+            error = RuntimeError("; ".join(errors))
+        if error is not None:
+            barad_logger.error("[SHD] Window %d failed: %s", seq, str(error))
+        context.release(error)
+
+    def _reap(self):
+        """
+        Fails the windows waiting for a worker that exited.
+        """
+        dead = {index for index, process in enumerate(self.processes) if not process.is_alive()}
+        if not dead:
+            return
+        self.dead |= dead
+        with self.condition:
+            stalled = [seq for seq, (_, expected, _) in self.pending.items() if expected & dead]
+        for seq in stalled:
+            self._complete(seq, RuntimeError(f"Shards {sorted(dead)} exited while processing the window."))
+
+    def _collect(self):
+        while True:
+            with self.condition:
+                if self.stopping and not self.pending:
+                    return
+            try:
+                seq, index, error, records, snapshot = self.outbox.get(timeout=self.reply_timeout)
+            except queue.Empty:
+                self._reap()
+                continue
+
+            metrics.extend(records)
+            metrics.merge(f"shard-{index}", snapshot)
+            with self.condition:
+                if seq not in self.pending:
+                    continue
+                _, expected, errors = self.pending[seq]
+                expected.discard(index)
+                if error is not None:
+                    errors.append(f"shard {index}: {error}")
+                done = not expected
+            if done:
+                self._complete(seq)
+
+    def update(self, context: PacketContext):
+        if self.dead:
+            raise RuntimeError(f"Shards {sorted(self.dead)} exited.")
+
+        flush = context.metadata.get("flush", False)
+        tick = context.metadata.get("tick", False)
+        linktype = context.metadata.get("linktype")
+        metadata = {"flush": flush, "tick": tick, "linktype": linktype, "raw": context.metadata.get("raw", False)}
+
+        # Flushes and ticks reach every shard, each one expiring its own flow table.
+        parts = [[] for _ in range(self.shards)] if flush or tick else self.route(context.packets, linktype)
+
+        expected = {index for index, part in enumerate(parts) if part or flush or tick}
+        if not expected:
+            return
+
+        self.slots.acquire()
+        self.seq += 1
+        context.retain()
+        with self.condition:
+            self.pending[self.seq] = (context, expected, [])
+        for index in expected:
+            self.inboxes[index].put((self.seq, parts[index], metadata))
@@ -0,0 +1,91 @@
+import time
+import calendar
+from datetime import datetime
+
+
+class TimestampError(ValueError):
+    pass
+
+
+class EveTimestampDecoder:
+    """
+    Decodes Suricata eve timestamps ("2025-02-24T17:18:41.123456+0100") to
+    (seconds, microseconds) since the epoch.
+
+    Consecutive events mostly share the same second, so the epoch of the
+    date/second prefix and its offset is cached and only the fraction is parsed.
+    Other ISO-8601 forms fall back to datetime.
+    """
+
+    def __init__(self):
+        self._cache = (None, 0)
+
+    def _prefix_seconds(self, prefix: str, offset: str) -> int:
+        try:
+            seconds = calendar.timegm((
+                int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]),
+                int(prefix[11:13]), int(prefix[14:16]), int(prefix[17:19]),
+            ))
+            utc_offset = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        except ValueError:
+            raise TimestampError(f"Invalid eve timestamp: {prefix}{offset}")
+
+        return seconds - utc_offset if offset[0] == "+" else seconds + utc_offset
+
+    def _fallback(self, timestamp: str) -> tuple:
+        try:
+            dt = datetime.fromisoformat(timestamp)
+        except ValueError:
+            raise TimestampError(f"Invalid eve timestamp: {timestamp}")
+
+        if dt.tzinfo is None:
+            raise TimestampError(f"Eve timestamp without timezone offset: {timestamp}")
+        seconds = calendar.timegm(dt.utctimetuple())
+        return seconds, dt.microsecond
+
+    def decode(self, timestamp: str) -> tuple:
+        """
+        Returns the (seconds, microseconds) since the epoch of an eve timestamp.
+        """
+        if len(timestamp) != 31 or timestamp[19] != "." or timestamp[26] not in "+-":
+            return self._fallback(timestamp)
+
+        key = timestamp[:19] + timestamp[26:]
+        cached_key, seconds = self._cache
+        if key != cached_key:
+            seconds = self._prefix_seconds(timestamp[:19], timestamp[26:])
+            self._cache = (key, seconds)
+
+        try:
+            return seconds, int(timestamp[20:26])
+        except ValueError:
+            raise TimestampError(f"Invalid eve timestamp: {timestamp}")
+
+
+_decoder = EveTimestampDecoder()
+
+
+def parse_timestamp(timestamp: str) -> tuple:
+    """
+    Converts an eve timestamp to (seconds, microseconds) since the epoch.
+    """
+    return _decoder.decode(timestamp)
+
+
+def parse_event_timestamp(timestamp: str) -> float:
+    """
+    Converts an eve timestamp to seconds since the epoch.
+    """
+    seconds, microseconds = _decoder.decode(timestamp)
+    return seconds + microseconds * 1e-6
+
+
+def format_event_timestamp(timestamp: float) -> str:
+    """
+    Converts seconds since the epoch to an eve timestamp in UTC.
+    """
+    seconds = int(timestamp)
+    microseconds = int(round((timestamp - seconds) * 1e6))
+    if microseconds == 1000000:
+        seconds, microseconds = seconds + 1, 0
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + ".%06d+0000" % microseconds